@@ -0,0 +1,50 @@
+from collections import OrderedDict
+import os
+
+
+class AVControl(object):
+    """
+    Video aspect and policy files in root with cached state,
+    only values which differ from it are written. Original value
+    is read before the first write, so it can be restored.
+    """
+
+    def __init__(self, root='/proc/stb/video'):
+        self.root = root
+        self.state = {}
+        self.defaults = OrderedDict()
+
+    def get(self, name):
+        if name not in self.state:
+            try:
+                with open(os.path.join(self.root, name), 'r') as f:
+                    value = f.read().strip()
+            except OSError:
+                value = None
+            self.state[name] = value
+            self.defaults.setdefault(name, value)
+        return self.state[name]
+
+    def set(self, values):
+        """
+        Writes (name, value) items, None values are skipped,
+        returns list of actually written names
+        """
+        written = []
+        for name, value in values:
+            if not value or self.get(name) == value:
+                continue
+            try:
+                with open(os.path.join(self.root, name), 'w') as f:
+                    f.write(value)
+            except OSError as e:
+                print('[AVControl] cannot write %s: %s' % (name, str(e)))
+                # state is unknown now
+                del self.state[name]
+            else:
+                self.state[name] = value
+                written.append(name)
+        return written
+
+    def restore(self):
+        return self.set(list(self.defaults.items()))
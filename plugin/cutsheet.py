@@ -0,0 +1,79 @@
+from bisect import bisect_left, bisect_right
+
+# cut types as used by enigma2 cuesheet, same as InfoBarCueSheetSupport.CUT_TYPE_*
+CUT_TYPE_IN = 0
+CUT_TYPE_OUT = 1
+CUT_TYPE_MARK = 2
+CUT_TYPE_LAST = 3
+
+
+class CutPointDistance(object):
+    """
+    Distance function for InfoBarCueSheetSupport.getNearestCutPoint,
+    direction 0 is absolute distance, direction 1 (-1) accepts only
+    points at least offset after (before) the position
+    """
+
+    def __init__(self, direction=0, offset=0):
+        self.direction = direction
+        self.offset = offset
+
+    def __call__(self, x):
+        if self.direction == 0:
+            return abs(x)
+        return self.direction * x - self.offset
+
+
+class CutSheet(object):
+    """
+    Index of a cut list answering mark lookups with bisect,
+    it has to be built again whenever the cut list changes
+    """
+
+    def __init__(self, cutList):
+        # start point when cut list begins with IN cut, otherwise 0
+        self.first = None
+        # MARK and LAST points within IN/OUT segments, sorted
+        self.marks = []
+        self.endCut = False
+        beforecut = True
+        instate = True
+        for cp in sorted(cutList):
+            if cp[1] == CUT_TYPE_IN:
+                if beforecut:
+                    # start is here, disregard previous marks
+                    beforecut = False
+                    self.first = cp
+                    del self.marks[:]
+                instate = True
+            elif cp[1] == CUT_TYPE_OUT:
+                beforecut = False
+                if instate:
+                    self.endCut = cp[0]
+                instate = False
+            elif cp[1] in (CUT_TYPE_MARK, CUT_TYPE_LAST) and instate:
+                self.marks.append(cp)
+        self.keys = [cp[0] for cp in self.marks]
+
+    def nearest(self, pts, distance, start=False):
+        # on equal distance the point earlier in cut list wins
+        keys = self.keys
+        if distance.direction > 0:
+            i = bisect_left(keys, pts + distance.offset)
+        elif distance.direction < 0:
+            i = bisect_right(keys, pts - distance.offset) - 1
+            if i > 0:
+                i = bisect_left(keys, keys[i])
+        else:
+            i = bisect_left(keys, pts)
+            if i > 0:
+                j = bisect_left(keys, keys[i - 1])
+                if i == len(keys) or pts - keys[j] <= keys[i] - pts:
+                    i = j
+        nearest = 0 <= i < len(keys) and self.marks[i] or None
+        if start:
+            first = self.first or [0, False]
+            diff = distance(first[0] - pts)
+            if diff >= 0 and (nearest is None or diff <= distance(nearest[0] - pts)):
+                nearest = first
+        return nearest
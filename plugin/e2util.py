@@ -4,6 +4,9 @@ Created on Jun 19, 2015
 @author: marko
 '''
 from bisect import insort
+from collections import OrderedDict
+import os
+import time
 import traceback
 
 from Components.ActionMap import HelpableActionMap
@@ -16,16 +19,22 @@ from Screens.InfoBarGenerics import InfoBarShowHide, InfoBarAudioSelection
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
 from Tools import Notifications
+from Tools.BoundFunction import boundFunction
 from Tools.Directories import resolveFilename, SCOPE_CONFIG
 
 from enigma import iPlayableService, eTimer, getDesktop
 from skin import parseColor
+from twisted.internet import reactor, threads
 
 from .settings import SERVICE_EXTEPLAYER3, SERVICE_GSTPLAYER, SERVICEMP3
+from .avcontrol import AVControl
+from .cutsheet import CutPointDistance, CutSheet
 
 
 # InfoBarCueSheetSupport from OpenPli with removed getLastPosition and
-# with delayed __serviceStarted, in case serviceReference is not yet set (BH image)
+# with delayed __servicePlaying, in case serviceReference is not yet set (BH image),
+# it waits for the first service event which brings it, polling only as fallback,
+# resume decision waits also for service length
 # changed on_movie_start config
 
 class InfoBarCueSheetSupport:
@@ -36,6 +45,10 @@ class InfoBarCueSheetSupport:
 
     ENABLE_RESUME_SUPPORT = False
 
+    # fallback polling delays (ms) while waiting for service reference or length, the last one repeats
+    SERVICE_READY_DELAYS = (20, 50, 100, 200, 500)
+    SERVICE_READY_TIMEOUT = 10000
+
     def __init__(self, actionmap="InfobarCueSheetActions"):
         self["CueSheetActions"] = HelpableActionMap(self, actionmap,
             {
@@ -44,44 +57,158 @@ class InfoBarCueSheetSupport:
                 "toggleMark": (self.toggleMark, _("Toggle a cut mark at the current position"))
             }, prio=1)
 
+        # incremented on every cut_list change
+        self.cutListVersion = 0
         self.cut_list = []
+        # False until cut list of current service is downloaded
+        self.cutListLoaded = False
         self.is_closing = False
+        # monotonic time of evStart while waiting for service reference and length
+        self.__startedAt = None
+        self.__downloadStarted = False
+        self.__readyAttempts = 0
+        # time to ready metric, in ms
+        self.serviceReadyTime = None
+        self.serviceReadyStats = {'count': 0, 'total': 0, 'max': 0, 'timeouts': 0}
+        # position (pts) to seek to once service becomes seekable
+        self.__pendingSeek = None
         self.timer = eTimer()
-        self.timer.callback.append(self.__isServiceStarted)
+        self.timer.callback.append(boundFunction(self.__isServiceStarted, 'poll'))
         self.__event_tracker = ServiceEventTracker(screen=self, eventmap={
                 iPlayableService.evStart: self.__serviceStarted,
                 iPlayableService.evEnd: self.__serviceStopped,
                 iPlayableService.evCuesheetChanged: self.downloadCuesheet,
+                iPlayableService.evUpdatedInfo: boundFunction(self.__isServiceStarted, 'evUpdatedInfo'),
+                iPlayableService.evSeekableStatusChanged: self.__seekableStatusChanged,
+                iPlayableService.evVideoSizeChanged: boundFunction(self.__isServiceStarted, 'evVideoSizeChanged'),
+                iPlayableService.evBuffering: boundFunction(self.__isServiceStarted, 'evBuffering'),
             })
         self.onClose.append(self.__onClose)
 
+    @property
+    def cut_list(self):
+        return self.__cut_list
+
+    @cut_list.setter
+    def cut_list(self, cut_list):
+        self.__cut_list = cut_list
+        self.cutListChanged()
+
+    def cutListChanged(self):
+        """
+        Has to be called after in place changes of cut_list
+        """
+        self.cutListVersion += 1
+        self.__cutSheet = None
+
+    def getCutSheet(self):
+        if self.__cutSheet is None:
+            self.__cutSheet = CutSheet(self.cut_list)
+        return self.__cutSheet
+
     def __serviceStarted(self):
         if self.is_closing:
             return
-        self.timer.start(100)
+        # marks of previous service must not be saved under the new one
+        self.cut_list = []
+        self.cutListLoaded = False
+        self.__startedAt = time.monotonic()
+        self.__readyAttempts = 0
+        self.__downloadStarted = False
+        self.__isServiceStarted('evStart')
 
     def __serviceStopped(self):
         self.timer.stop()
+        self.__startedAt = None
+        self.__pendingSeek = None
+        self.cut_list = []
+        self.cutListLoaded = False
+
+    def __seekableStatusChanged(self):
+        self.__isServiceStarted('evSeekableStatusChanged')
+        self.__applyPendingSeek()
+
+    def seekWhenReady(self, pts):
+        """
+        Seeks to pts right away when service is seekable, otherwise
+        once it becomes seekable. Seek is done only once.
+        """
+        self.__pendingSeek = pts
+        self.__applyPendingSeek()
+
+    def __applyPendingSeek(self):
+        if self.__pendingSeek is None:
+            return
+        seekable = self.__getSeekable()
+        if seekable is None or not seekable.isCurrentlySeekable():
+            return
+        pts, self.__pendingSeek = self.__pendingSeek, None
+        self.doSeek(pts)
 
-    def __isServiceStarted(self):
-        if self.session.nav.getCurrentlyPlayingServiceReference() is not None:
-            self.timer.stop()
+    def __hasLength(self):
+        seekable = self.__getSeekable()
+        if seekable is None:
+            return False
+        length = seekable.getLength()
+        return bool(length and not length[0] and length[1] > 0)
+
+    def __isServiceStarted(self, trigger):
+        if self.__startedAt is None:
+            return
+        elapsed = int((time.monotonic() - self.__startedAt) * 1000)
+        timeout = elapsed >= self.SERVICE_READY_TIMEOUT
+        if not self.__downloadStarted and self.session.nav.getCurrentlyPlayingServiceReference() is not None:
+            self.__downloadStarted = True
+            self.serviceReadyTime = elapsed
+            stats = self.serviceReadyStats
+            stats['count'] += 1
+            stats['total'] += elapsed
+            stats['max'] = max(stats['max'], elapsed)
+            print('[InfoBarCueSheet] service ready after %d ms (%s)' % (elapsed, trigger))
+            # cut list may be cached, then resume is decided right from here
             self.__servicePlaying()
-        else:
-            print('service not yet started...')
+            if self.__startedAt is None:
+                return
+        if self.cutListLoaded:
+            # resume decision needs length, before preroll it is usually still 0,
+            # services which never report it are handled when timeout expires
+            if self.__getResumePoint() is None or self.__hasLength() or timeout:
+                self.timer.stop()
+                self.__startedAt = None
+                self.__decideResume()
+                return
+        if timeout:
+            self.timer.stop()
+            self.__startedAt = None
+            if not self.__downloadStarted:
+                self.serviceReadyStats['timeouts'] += 1
+                print('[InfoBarCueSheet] service not started within %d ms, cuts not loaded' % elapsed)
+        elif trigger in ('evStart', 'poll'):
+            # events did not bring service reference or length yet, poll with backoff
+            delay = self.SERVICE_READY_DELAYS[min(self.__readyAttempts, len(self.SERVICE_READY_DELAYS) - 1)]
+            self.__readyAttempts += 1
+            self.timer.start(delay, True)
 
     def __servicePlaying(self):
         print("new service started! trying to download cuts!")
-        self.downloadCuesheet()
-
-        if self.ENABLE_RESUME_SUPPORT:
-            last = None
-            for (pts, what) in self.cut_list:
-                if what == self.CUT_TYPE_LAST:
-                    last = pts
-                    break
-            if last is None:
-                return
+        self.downloadCuesheet(self.__cuesheetDownloaded)
+
+    def __cuesheetDownloaded(self):
+        self.cutListLoaded = True
+        self.__isServiceStarted('cuesheet')
+
+    def __getResumePoint(self):
+        if not self.ENABLE_RESUME_SUPPORT:
+            return None
+        for (pts, what) in self.cut_list:
+            if what == self.CUT_TYPE_LAST:
+                # only resume if at least 10 seconds ahead
+                return pts > 900000 and pts or None
+        return None
+
+    def __decideResume(self):
+        last = self.__getResumePoint()
+        if last is not None:
             # only resume if at least 10 seconds ahead, or <10 seconds before the end.
             seekable = self.__getSeekable()
             if seekable is None:
@@ -96,6 +223,9 @@ class InfoBarCueSheetSupport:
                 if "ask" in on_movie_start or not length[1]:
                     Notifications.AddNotificationWithCallback(self.playLastCB, MessageBox, _("Do you want to resume this playback?") + "\n" + (_("Resume position at %s") % ("%d:%02d:%02d" % (l / 3600, l % 3600 / 60, l % 60))), timeout=10, default="yes" in on_movie_start)
                 elif on_movie_start == "resume":
+                    # seek as soon as service is seekable, not after the message is gone,
+                    # length is known only after preroll, so first buffering is usually done
+                    self.seekWhenReady(self.resume_point)
 # TRANSLATORS: The string "Resuming playback" flashes for a moment
 # TRANSLATORS: at the start of a movie, when the user has selected
 # TRANSLATORS: "Resume from last position" as start behavior.
@@ -103,11 +233,14 @@ class InfoBarCueSheetSupport:
 # TRANSLATORS: in the middle somewhere and not from the beginning.
 # TRANSLATORS: (Some translators seem to have interpreted it as a
 # TRANSLATORS: question or a choice, but it is a statement.)
-                    Notifications.AddNotificationWithCallback(self.playLastCB, MessageBox, _("Resuming playback"), timeout=2, type=MessageBox.TYPE_INFO)
+                    Notifications.AddNotificationWithCallback(self.resumedCB, MessageBox, _("Resuming playback"), timeout=2, type=MessageBox.TYPE_INFO)
 
     def playLastCB(self, answer):
         if answer == True:
-            self.doSeek(self.resume_point)
+            self.seekWhenReady(self.resume_point)
+        self.hideAfterResume()
+
+    def resumedCB(self, answer):
         self.hideAfterResume()
 
     def hideAfterResume(self):
@@ -130,16 +263,7 @@ class InfoBarCueSheetSupport:
         return int(r[1])
 
     def cueGetEndCutPosition(self):
-        ret = False
-        isin = True
-        for cp in self.cut_list:
-            if cp[1] == self.CUT_TYPE_OUT:
-                if isin:
-                    isin = False
-                    ret = cp[0]
-            elif cp[1] == self.CUT_TYPE_IN:
-                isin = True
-        return ret
+        return self.getCutSheet().endCut
 
     def jumpPreviousNextMark(self, cmp, start=False):
         current_pos = self.cueGetCurrentPosition()
@@ -157,14 +281,18 @@ class InfoBarCueSheetSupport:
     def jumpPreviousMark(self):
         # we add 5 seconds, so if the play position is <5s after
         # the mark, the mark before will be used
-        self.jumpPreviousNextMark(lambda x: -x - 5 * 90000, start=True)
+        self.jumpPreviousNextMark(CutPointDistance(-1, 5 * 90000), start=True)
 
     def jumpNextMark(self):
-        if not self.jumpPreviousNextMark(lambda x: x - 90000):
+        if not self.jumpPreviousNextMark(CutPointDistance(1, 90000)):
             self.doSeek(-1)
 
     def getNearestCutPoint(self, pts, cmp=abs, start=False):
-        # can be optimized
+        if cmp is abs:
+            cmp = CutPointDistance()
+        if isinstance(cmp, CutPointDistance):
+            return self.getCutSheet().nearest(pts, cmp, start)
+        # arbitrary distance function, scan whole cut list
         beforecut = True
         nearest = None
         bestdiff = -1
@@ -216,11 +344,13 @@ class InfoBarCueSheetSupport:
 
     def addMark(self, point):
         insort(self.cut_list, point)
+        self.cutListChanged()
         self.uploadCuesheet()
         self.showAfterCuesheetOperation()
 
     def removeMark(self, point):
         self.cut_list.remove(point)
+        self.cutListChanged()
         self.uploadCuesheet()
         self.showAfterCuesheetOperation()
 
@@ -242,7 +372,7 @@ class InfoBarCueSheetSupport:
             return
         cue.setCutList(self.cut_list)
 
-    def downloadCuesheet(self):
+    def downloadCuesheet(self, callback=None):
         cue = self.__getCuesheet()
 
         if cue is None:
@@ -250,6 +380,8 @@ class InfoBarCueSheetSupport:
             self.cut_list = []
         else:
             self.cut_list = cue.getCutList()
+        if callback is not None:
+            callback()
 
     def __onClose(self):
         self.timer.stop()
@@ -264,13 +396,78 @@ class MyInfoBarCueSheetSupport(InfoBarCueSheetSupport):
         gaugeRenderer = self.getGaugeRenderer(self.renderer)
         gaugeRenderers = gaugeRenderers or gaugeRenderer and [gaugeRenderer] or []
         self.__gaugeRenderers = gaugeRenderers
-        self.__cutList = CutList(dbfilename)
+        # True when renderers show our cut list, False when they ask service
+        self.__gaugeCustom = None
+        self.__gaugeVersion = None
+        self.__gaugeTimer = eTimer()
+        self.__gaugeTimer.callback.append(self.__updateGaugeRenderers)
+        self.__cutList = CutList(dbfilename, config.plugins.mediaplayer2.cutListCacheSize.value)
+        self.__checkpointTimer = eTimer()
+        self.__checkpointTimer.callback.append(self.__checkpoint)
+        self.__cutListEventTracker = ServiceEventTracker(screen=self, eventmap={
+                iPlayableService.evStart: self.__startCheckpoints,
+                iPlayableService.evEnd: self.__serviceEnded,
+            })
+        self.onClose.append(self.__checkpointTimer.stop)
+        self.onClose.append(self.__gaugeTimer.stop)
+        self.onClose.append(self.__cutList.close)
+
+    def __serviceEnded(self):
+        self.__checkpointTimer.stop()
+        self.__cutList.flush()
+
+    def __startCheckpoints(self):
+        interval = config.plugins.mediaplayer2.positionCheckpointInterval.value
+        if self.cueSheetForServicemp3 and interval and config.plugins.mediaplayer2.saveLastPosition.value:
+            self.__checkpointTimer.start(interval * 1000)
+
+    def __checkpoint(self):
+        sref = self.session.nav.getCurrentlyPlayingServiceReference()
+        if sref is None or sref.type not in (SERVICE_GSTPLAYER, SERVICE_EXTEPLAYER3, SERVICEMP3):
+            return
+        position = self.cueGetCurrentPosition()
+        if position is None:
+            return
+        duration = self.__getDuration()
+        # same end limit as saveLastPosition
+        if duration and not (duration - position > 60 * 90 * 1000):
+            return
+        self.__cutList.checkpoint(sref.getPath(), position, duration)
+
+    def invalidateCutLists(self):
+        self.__cutList.invalidate()
+
+    def runCueSheetMaintenance(self, callback=None):
+        self.__cutList.runMaintenance(callback)
+
+    def prefetchCutLists(self, paths):
+        if self.cueSheetForServicemp3:
+            self.__cutList.prefetch(paths)
+
+    def cueSheetDAOCall(self, method, args=(), callback=None, invalidate=False):
+        self.__cutList.callDAO(method, args, callback, invalidate)
+
+    def __getDuration(self):
+        service = self.session.nav.getCurrentService()
+        seekable = service and service.seek()
+        length = seekable and seekable.getLength()
+        if not length or length[0]:
+            return None
+        return int(length[1]) or None
 
     def __defaultGaugeRenderers(self):
+        if self.__gaugeCustom is False:
+            return
+        self.__gaugeCustom = False
         for r in self.__gaugeRenderers:
             r.cutlist_changed = PositionGauge.__dict__['cutlist_changed'].__get__(r, PositionGauge)
 
     def __customGuageRenderers(self):
+        if self.__gaugeCustom:
+            return
+        self.__gaugeCustom = True
+        # renderers have to show current cut list again
+        self.__gaugeVersion = None
         for r in self.__gaugeRenderers:
             r.cutlist_changed = lambda: self.cut_list
 
@@ -293,31 +490,29 @@ class MyInfoBarCueSheetSupport(InfoBarCueSheetSupport):
             print("[InfoBarCueSheet] saveLastPosition - not saving position, its within end limit")
             self.removeLastPosition()
             return
-        # cleanup LAST marks
-        for mark in self.cut_list[:]:
-            if mark[1] == InfoBarCueSheetSupport.CUT_TYPE_LAST:
-                self.cut_list.remove(mark)
         l = position / 90000
         print("[InfoBarCueSheet] saveLastPosition - saving position %d:%02d:%02d" % ((l / 3600, l % 3600 / 60, l % 60)))
-        self.addMark((position, InfoBarCueSheetSupport.CUT_TYPE_LAST))
+        self.replaceLastPosition(position)
 
     def removeLastPosition(self):
-        last_mark = None
-        for mark in self.cut_list:
-            if mark[1] == InfoBarCueSheetSupport.CUT_TYPE_LAST:
-                last_mark = mark
-
-        for mark in self.cut_list[:]:
-            if mark[1] == InfoBarCueSheetSupport.CUT_TYPE_LAST:
-                if last_mark is not None and mark != last_mark:
-                    self.cut_list.remove(mark)
-
-        if last_mark is None:
+        if not self.replaceLastPosition(None):
             print("[InfoBarCueSheet] removeLastPosition - nothing to remove")
             return
-        l = last_mark[0] / 90000
-        print("[InfoBarCueSheet] removeLastPosition - %d:%02d:%02d" % ((l / 3600, l % 3600 / 60, l % 60)))
-        self.removeMark(last_mark)
+        print("[InfoBarCueSheet] removeLastPosition - removed")
+
+    def replaceLastPosition(self, position):
+        """
+        Replaces all LAST marks by one at position, or removes them when position
+        is None. Changed cut list is uploaded once, returns True when changed.
+        """
+        cut_list = [mark for mark in self.cut_list if mark[1] != InfoBarCueSheetSupport.CUT_TYPE_LAST]
+        if position is not None:
+            insort(cut_list, (position, InfoBarCueSheetSupport.CUT_TYPE_LAST))
+        if cut_list == self.cut_list:
+            return False
+        self.cut_list = cut_list
+        self.uploadCuesheet()
+        return True
 
     def getGaugeRenderer(self, rendererList):
         i = 0
@@ -336,10 +531,19 @@ class MyInfoBarCueSheetSupport(InfoBarCueSheetSupport):
         return positionGauge
 
     def updateGaugeRenderers(self):
+        # coalesce updates to one per main loop iteration
+        if not self.__gaugeTimer.isActive():
+            self.__gaugeTimer.start(0, True)
+
+    def __updateGaugeRenderers(self):
+        if self.__gaugeVersion == self.cutListVersion:
+            return
+        self.__gaugeVersion = self.cutListVersion
+        cutlist = [(int(x[0]), int(x[1])) for x in self.cut_list]
         for r in self.__gaugeRenderers:
-            r.setCutlist([(int(x[0]), int(x[1])) for x in (cut for cut in self.cut_list)])
+            r.setCutlist(cutlist)
 
-    def downloadCuesheet(self):
+    def downloadCuesheet(self, callback=None):
         if self.cueSheetForServicemp3:
             sref = self.session.nav.getCurrentlyPlayingServiceReference()
             if sref is None:
@@ -348,25 +552,36 @@ class MyInfoBarCueSheetSupport(InfoBarCueSheetSupport):
             print('[InfobarCueSheetSupport] downloadCuesheet - serviceReference type : %d' % sref.type)
             if sref.type in (SERVICE_GSTPLAYER, SERVICE_EXTEPLAYER3, SERVICEMP3):
                 try:
-                    self.cut_list = self.__cutList.getCutList(sref.getPath())
+                    self.__cutList.getCutListAsync(sref.getPath(), boundFunction(self.__cutListDownloaded, sref, callback))
                 except Exception:
                     traceback.print_exc()
-                else:
-                    self.__customGuageRenderers()
-                    self.updateGaugeRenderers()
             else:
                 self.__defaultGaugeRenderers()
-                InfoBarCueSheetSupport.downloadCuesheet(self)
+                InfoBarCueSheetSupport.downloadCuesheet(self, callback)
         else:
-            InfoBarCueSheetSupport.downloadCuesheet(self)
+            InfoBarCueSheetSupport.downloadCuesheet(self, callback)
+
+    def __cutListDownloaded(self, sref, callback, cutList):
+        if sref != self.session.nav.getCurrentlyPlayingServiceReference():
+            print('[InfobarCueSheetSupport] downloadCuesheet - service changed, dropping cut list')
+            return
+        self.cut_list = cutList
+        self.__customGuageRenderers()
+        self.updateGaugeRenderers()
+        if callback is not None:
+            callback()
 
     def uploadCuesheet(self):
+        if not self.cutListLoaded:
+            # stored marks would be overwritten by incomplete cut list
+            print('[InfobarCueSheetSupport] uploadCuesheet - cut list not loaded yet, not saving')
+            return
         if self.cueSheetForServicemp3:
             sref = self.session.nav.getCurrentlyPlayingServiceReference()
             sref_type = sref and sref.type
             if sref_type and sref_type in (SERVICE_GSTPLAYER, SERVICE_EXTEPLAYER3, SERVICEMP3):
                 try:
-                    self.__cutList.setCutList(sref.getPath(), self.cut_list)
+                    self.__cutList.setCutList(sref.getPath(), self.cut_list, self.__getDuration())
                 except Exception:
                     traceback.print_exc()
                 else:
@@ -420,28 +635,257 @@ class StatusScreen(Screen):
 
 
 class CutList(object):
-    def __init__(self, filename):
+    # cut lists are written to db after this idle delay (ms),
+    # so rapid mark edits end up in one transaction
+    FLUSH_DELAY = 3000
+    CACHE_SIZE = 50
+    maintenanceStarted = False
+
+    def __init__(self, filename, cacheSize=CACHE_SIZE, asynchronous=True):
+        # path -> cut list in db format, not yet handed to db
+        self.pending = {}
+        # path -> duration in seconds, not yet handed to db
+        self.durations = {}
+        # path -> cut list in db format, handed to db worker but not yet written
+        self.inflight = {}
+        # path -> callbacks waiting for cut list being loaded from db
+        self.loading = {}
+        self.flushTimer = eTimer()
+        self.flushTimer.callback.append(self.flush)
+        # LRU of decoded cut lists, path -> tuple of (pts, type)
+        self.cache = OrderedDict()
+        self.cacheSize = cacheSize
+        self.cacheHits = 0
+        self.cacheMisses = 0
+        self.checkpoints = None
         try:
-            from util import CueSheetDAO
+            from .util import CueSheetDAO, AsyncCueSheetDAO, PositionCheckpoint
         except ImportError as e:
             self.sqlite3 = False
         else:
             self.sqlite3 = True
             self.cueSheetDAO = CueSheetDAO(resolveFilename(SCOPE_CONFIG, filename))
+            self.asyncDAO = AsyncCueSheetDAO(self.cueSheetDAO, asynchronous and reactor.callFromThread or None)
+            self.checkpoints = PositionCheckpoint(resolveFilename(SCOPE_CONFIG, os.path.splitext(filename)[0] + '.checkpoint'))
+            self.__reconcileCheckpoints()
+
+    def __reconcileCheckpoints(self):
+        try:
+            checkpoints = self.checkpoints.latest()
+        except (OSError, ValueError) as e:
+            print('[CutList] cannot read checkpoints:', str(e))
+            self.checkpoints = None
+            return
+        if checkpoints:
+            sequence = max(checkpoint[0] for checkpoint in checkpoints.values())
+            self.callDAO('reconcile_checkpoints', (checkpoints,), boundFunction(self.__checkpointsReconciled, sequence), invalidate=True)
+
+    def __checkpointsReconciled(self, sequence, restored):
+        if restored is not None and self.checkpoints is not None:
+            self.checkpoints.clear(sequence)
+
+    def checkpoint(self, path, position, duration=None):
+        if self.checkpoints is None:
+            return
+        try:
+            self.checkpoints.write(self.__decodePath(path), position, duration)
+        except (OSError, ValueError) as e:
+            print('[CutList] cannot write checkpoint:', str(e))
 
     def getCutList(self, path):
         if not self.sqlite3:
             print('[CutList] python-sqlite3 not installed')
             return []
-        cutList = self.cueSheetDAO.get_cut_list(path)
-        if cutList is not None:
-            return [(int(x[0] * 90000), int(x[1])) for x in (x for x in cutList)]
+        path = self.__decodePath(path)
+        cutList = self.__getCached(path)
+        if cutList is None:
+            stored = self.__getUnwritten(path)
+            if stored is None:
+                stored = self.cueSheetDAO.get_cut_list(path)
+            cutList = self.__decode(path, stored)
+        return cutList
+
+    def getCutListAsync(self, path, callback):
+        """
+        Calls callback(cutList) on main loop, immediately when cut list is cached
+        """
+        if not self.sqlite3:
+            print('[CutList] python-sqlite3 not installed')
+            callback([])
+            return
+        path = self.__decodePath(path)
+        cutList = self.__getCached(path)
+        if cutList is None:
+            stored = self.__getUnwritten(path)
+            if stored is None:
+                self.__load(path, callback)
+                return
+            cutList = self.__decode(path, stored)
+        callback(cutList)
+
+    def prefetch(self, paths):
+        """
+        Loads cut lists of paths into cache in background
+        """
+        if not self.sqlite3 or self.cacheSize <= 0:
+            return
+        for path in paths:
+            path = self.__decodePath(path)
+            if path not in self.cache and path not in self.loading and self.__getUnwritten(path) is None:
+                # content identity lookup reads the file, it is left to playback
+                self.__load(path, byIdentity=False)
+
+    def __load(self, path, callback=None, byIdentity=True):
+        # one db read per path, later callers wait for the pending one
+        callbacks = self.loading.get(path)
+        if callbacks is None:
+            callbacks = self.loading[path] = []
+            self.asyncDAO.get_cut_list(path, boundFunction(self.__cutListLoaded, path, byIdentity), boundFunction(self.__cutListFailed, path), byIdentity)
+        if callback is not None:
+            callbacks.append(callback)
+
+    def __cutListLoaded(self, path, byIdentity, stored):
+        callbacks = self.loading.pop(path, ())
+        # cut list could be changed meanwhile
+        unwritten = self.__getUnwritten(path)
+        if unwritten is not None:
+            stored = unwritten
+        elif not stored and not byIdentity:
+            # path is not stored, it may be still known by content identity
+            for callback in callbacks:
+                self.__load(path, callback)
+            return
+        cutList = self.__decode(path, stored)
+        for callback in callbacks:
+            callback(list(cutList))
 
-    def setCutList(self, path, cutList):
+    def __cutListFailed(self, path, e):
+        self.loading.pop(path, None)
+        print('[CutList] loading cut list failed', str(e))
+
+    def setCutList(self, path, cutList, duration=None):
+        if not self.sqlite3:
+            print('[CutList] python-sqlite3 not installed')
+            return
+        path = self.__decodePath(path)
+        cutList = [(int(x[0] / 90000), int(x[1])) for x in (x for x in cutList)]
+        self.pending[path] = cutList
+        if duration is not None:
+            self.durations[path] = int(duration / 90000)
+        self.__cachePut(path, [(x[0] * 90000, x[1]) for x in cutList])
+        self.flushTimer.start(self.FLUSH_DELAY, True)
+
+    def invalidate(self, path=None):
+        if path is None:
+            self.pending.clear()
+            self.durations.clear()
+            self.cache.clear()
+        else:
+            path = self.__decodePath(path)
+            self.pending.pop(path, None)
+            self.durations.pop(path, None)
+            self.cache.pop(path, None)
+
+    def __getCached(self, path):
+        cutList = self.cache.get(path)
+        if cutList is None:
+            self.cacheMisses += 1
+            return None
+        self.cacheHits += 1
+        self.cache.move_to_end(path)
+        return list(cutList)
+
+    def __getUnwritten(self, path):
+        cutList = self.pending.get(path)
+        if cutList is None:
+            cutList = self.inflight.get(path)
+        return cutList
+
+    def __decode(self, path, stored):
+        cutList = [(int(x[0] * 90000), int(x[1])) for x in (x for x in stored)]
+        self.__cachePut(path, cutList)
+        return cutList
+
+    def __cachePut(self, path, cutList):
+        if self.cacheSize <= 0:
+            return
+        self.cache[path] = tuple(cutList)
+        self.cache.move_to_end(path)
+        while len(self.cache) > self.cacheSize:
+            self.cache.popitem(last=False)
+
+    def flush(self):
+        self.flushTimer.stop()
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        print('[CutList] flushing %d cut list(s)' % len(pending))
+        self.inflight.update(pending)
+        flushed = boundFunction(self.__flushed, pending)
+        self.asyncDAO.set_cut_lists([(path, cutList, self.durations.pop(path, None)) for path, cutList in pending.items()], flushed, flushed)
+
+    def __flushed(self, flushed, result):
+        for path, cutList in flushed.items():
+            if self.inflight.get(path) is cutList:
+                del self.inflight[path]
+
+    def callDAO(self, method, args=(), callback=None, invalidate=False):
+        """
+        Queues CueSheetDAO call after all pending writes, callback(result)
+        is called on main loop, with None on failure. Set invalidate
+        when the call modifies stored cut lists.
+        """
         if not self.sqlite3:
             print('[CutList] python-sqlite3 not installed')
             return
-        self.cueSheetDAO.set_cut_list(str(path, 'utf-8'), [(int(x[0] / 90000), int(x[1])) for x in (x for x in cutList)])
+        self.flush()
+        done = boundFunction(self.__daoCallDone, callback, invalidate)
+        self.asyncDAO.call(method, args, done, lambda e: done(None))
+
+    def __daoCallDone(self, callback, invalidate, result):
+        if invalidate:
+            self.cache.clear()
+        if callback is not None:
+            callback(result)
+
+    def runMaintenance(self, callback=None):
+        if not self.sqlite3:
+            print('[CutList] python-sqlite3 not installed')
+            return
+        from .util import CueSheetMaintenance
+        CutList.maintenanceStarted = True
+        self.flush()
+        maintenance = CueSheetMaintenance(self.cueSheetDAO,
+                                          config.plugins.mediaplayer2.positionsRetentionDays.value,
+                                          config.plugins.mediaplayer2.positionsRetentionCount.value)
+        d = threads.deferToThread(maintenance.run)
+        d.addCallback(self.__maintenanceFinished, callback)
+        d.addErrback(self.__maintenanceFailed, callback)
+
+    def __maintenanceFinished(self, stats, callback):
+        self.cache.clear()
+        if callback is not None:
+            callback(stats)
+
+    def __maintenanceFailed(self, failure, callback):
+        print('[CutList] maintenance failed', failure.getErrorMessage())
+        if callback is not None:
+            callback(None)
+
+    def close(self):
+        self.flush()
+        if self.sqlite3:
+            self.asyncDAO.close()
+            self.cueSheetDAO.stats.dump()
+        if self.checkpoints is not None:
+            self.checkpoints.close()
+            self.checkpoints = None
+        print('[CutList] cache hits: %d, misses: %d' % (self.cacheHits, self.cacheMisses))
+
+    def __decodePath(self, path):
+        if isinstance(path, bytes):
+            return path.decode('utf-8')
+        return path
 
 
 # audioSelection with removed subtitles support
@@ -486,21 +930,15 @@ class InfoBarAspectChange:
                                 '16_9_4_3_pillarbox', '16_9_4_3_panscan', '16_9_4_3_nonlinear', '16_9_4_3_bestfit',
                                 '4_3_letterbox', '4_3_panscan', '4_3_bestfit']
 
-    def __init__(self):
+    # mode is written after toggling stops for this long (ms), so key repeat ends up in one write
+    WRITE_DELAY = 300
+
+    def __init__(self, avControl=None):
         self.aspectChanged = False
-        try:
-            self.defaultAspect = open("/proc/stb/video/aspect", "r").read().strip()
-        except OSError:
-            self.defaultAspect = None
-        try:
-            self.defaultPolicy = open("/proc/stb/video/policy", "r").read().strip()
-        except OSError:
-            self.defaultPolicy = None
-        try:
-            self.defaultPolicy2 = open("/proc/stb/video/policy2", "r").read().strip()
-        except OSError:
-            self.defaultPolicy2 = None
+        self.avControl = avControl or AVControl()
         self.currentAVMode = self.V_MODES[0]
+        self.avModeTimer = eTimer()
+        self.avModeTimer.callback.append(self.__applyAVMode)
 
         self["aspectChangeActions"] = HelpableActionMap(self, "InfobarAspectChangeActions",
             {
@@ -517,21 +955,7 @@ class InfoBarAspectChange:
 
     def setAspect(self, aspect, policy, policy2):
         print('aspect: %s policy: %s policy2: %s' % (str(aspect), str(policy), str(policy2)))
-        if aspect:
-            try:
-                open("/proc/stb/video/aspect", "w").write(aspect)
-            except OSError as e:
-                print(e)
-        if policy:
-            try:
-                open("/proc/stb/video/policy", "w").write(policy)
-            except OSError as e:
-                print(e)
-        if policy2:
-            try:
-                open("/proc/stb/video/policy2", "w").write(policy2)
-            except OSError as e:
-                print(e)
+        self.avControl.set((('aspect', aspect), ('policy', policy), ('policy2', policy2)))
 
     def toggleAVMode(self):
         self.aspectChanged = True
@@ -541,6 +965,9 @@ class InfoBarAspectChange:
         else:
             modeIdx += 1
         self.currentAVMode = self.V_MODES[modeIdx]
+        self.avModeTimer.start(self.WRITE_DELAY, True)
+
+    def __applyAVMode(self):
         mode = self.V_DICT[self.currentAVMode]
         aspect = mode['aspect']
         policy = 'policy' in mode and mode['policy'] or None
@@ -548,5 +975,6 @@ class InfoBarAspectChange:
         self.setAspect(aspect, policy, policy2)
 
     def __onClose(self):
+        self.avModeTimer.stop()
         if self.aspectChanged:
-            self.setAspect(self.defaultAspect, self.defaultPolicy, self.defaultPolicy2)
+            self.avControl.restore()
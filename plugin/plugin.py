@@ -1,5 +1,6 @@
 import os
 import random
+import time
 from time import strftime
 import traceback
 
@@ -7,7 +8,7 @@ from Components.ActionMap import ActionMap, HelpableActionMap
 from Components.FileList import FileList, FILE_NAME, FILE_IS_DIR
 from Components.Harddisk import harddiskmanager
 from Components.Label import Label
-from Components.MediaPlayer import PlayList, STATE_STOP, STATE_NONE
+from Components.MediaPlayer import PlayList, PlaylistEntryComponent, STATE_STOP, STATE_NONE
 from Components.Pixmap import Pixmap, MultiPixmap
 from Components.Playlist import PlaylistIOInternal, PlaylistIOM3U, PlaylistIOPLS
 from Components.PluginComponent import plugins
@@ -27,9 +28,9 @@ from Tools.Directories import fileExists, resolveFilename, \
 
 from ServiceReference import ServiceReference
 from .e2util import InfoBarAspectChange, StatusScreen, MyAudioSelection, \
-    MyInfoBarCueSheetSupport
+    MyInfoBarCueSheetSupport, CutList, CutPointDistance
 from enigma import iPlayableService, eTimer, eServiceCenter, iServiceInformation, \
-    ePicLoad, getDesktop
+    ePicLoad, getDesktop, eListboxPythonMultiContent, RT_HALIGN_RIGHT, RT_VALIGN_CENTER
 from .settings import MediaPlayerSettings, LIBMEDIA_CHOICES, SERVICEMP3, SERVICE_GSTPLAYER, SERVICE_EXTEPLAYER3, ServiceGstPlayerApplySettings
 
 from . import _
@@ -48,26 +49,249 @@ try:
 except ImportError:
     AUDIO_EXTENSIONS = frozenset((".mp2", ".mp3", ".wav", ".ogg", ".flac", ".m4a"))
 
+# files added to playlist when adding whole directory
+MEDIA_EXTENSIONS = frozenset((".mp2", ".mp3", ".ogg", ".ts", ".mts", ".m2ts", ".wav", ".wave", ".mpg", ".vob", ".avi", ".divx",
+    ".m4v", ".mkv", ".mp4", ".m4a", ".dat", ".flac", ".flv", ".mov", ".dts", ".3gp", ".3g2", ".asf", ".wmv", ".wma", ".iso", ".webm"))
+PLAYLIST_EXTENSIONS = frozenset((".m3u", ".pls", ".e2pls"))
+# files shown in file browser
+FILELIST_PATTERN = r"(?i)^.*\.(%s)" % "|".join(sorted(ext[1:] for ext in MEDIA_EXTENSIONS | PLAYLIST_EXTENSIONS))
+
+
+def walkMediaFiles(directory, recursive=True):
+    """
+    Yields paths of media files in directory in FileList order, contents of
+    subdirectories before files, both sorted by name. None is yielded after
+    each scanned directory, so callers can give up control. File types are
+    taken from d_type, no stat is needed except for symlinks.
+    """
+    dirs = []
+    files = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if recursive:
+                            dirs.append(entry.name)
+                    elif os.path.splitext(entry.name)[1].lower() in MEDIA_EXTENSIONS:
+                        files.append(entry.name)
+                except OSError:
+                    pass
+    except OSError as e:
+        print("[MediaPlayer] cannot list %s: %s" % (directory, str(e)))
+    yield None
+    for name in sorted(dirs):
+        for path in walkMediaFiles(os.path.join(directory, name) + "/"):
+            yield path
+    for name in sorted(files):
+        yield os.path.join(directory, name)
+
 
 class MyPlayList(PlayList):
     def __init__(self):
+        # path -> ascending indices of entries, built lazily
+        self.__pathIndex = None
+        # cached service reference list and index -> entry info
+        self.__refs = None
+        self.__infos = {}
+        # called before entries are cleared
+        self.onClear = []
         PlayList.__init__(self)
         self.state = STATE_NONE
 
+    def _invalidate(self):
+        """
+        Has to be called after entries were removed or reordered
+        """
+        self.__pathIndex = None
+        self.__refs = None
+        self.__infos = {}
+
+    def getServiceRefList(self):
+        """
+        Returns cached list of service references, do not modify it
+        """
+        if self.__refs is None:
+            self.__refs = [x[0] for x in self.list]
+        return self.__refs
+
+    def getEntryInfo(self, index):
+        """
+        Returns (ref, file name, lower case extension, is audio) of entry at index
+        """
+        info = self.__infos.get(index)
+        if info is None:
+            ref = self.list[index][0]
+            name = ref.getPath().split('/')[-1]
+            ext = os.path.splitext(name)[1].lower()
+            info = self.__infos[index] = (ref, name, ext, ext in AUDIO_EXTENSIONS)
+        return info
+
+    def getPathIndex(self):
+        if self.__pathIndex is None:
+            self.__pathIndex = {}
+            for idx, x in enumerate(self.list):
+                self.__pathIndex.setdefault(x[0].getPath(), []).append(idx)
+        return self.__pathIndex
+
+    def findRef(self, ref):
+        """
+        Returns index of first entry equal to ref or -1
+        """
+        for idx in self.getPathIndex().get(ref.getPath(), ()):
+            if self.list[idx][0] == ref:
+                return idx
+        return -1
+
+    def deleteRef(self, ref):
+        """
+        Deletes all entries equal to ref in one pass, list is not refreshed.
+        Returns number of deleted entries.
+        """
+        deleted = [idx for idx in self.getPathIndex().get(ref.getPath(), ()) if self.list[idx][0] == ref]
+        if not deleted:
+            return 0
+        # same as deleteFile for every entry
+        self.currPlaying -= len([idx for idx in deleted if idx <= self.currPlaying])
+        deleted = set(deleted)
+        self.list[:] = [x for idx, x in enumerate(self.list) if idx not in deleted]
+        self._invalidate()
+        return len(deleted)
+
+    def addFile(self, serviceref):
+        self.addFiles((serviceref,), refresh=False)
+
+    def deleteFile(self, index):
+        PlayList.deleteFile(self, index)
+        self._invalidate()
+
+    def updateFile(self, index, newserviceref):
+        PlayList.updateFile(self, index, newserviceref)
+        self._invalidate()
+
+    def clear(self):
+        for f in self.onClear:
+            f()
+        PlayList.clear(self)
+        self._invalidate()
+
     def updateState(self, state):
         self.state = state
         PlayList.updateState(self, state)
 
+    def addFiles(self, refs, unique=False, refresh=True):
+        """
+        Appends service references with one list refresh, with unique set
+        references whose path is already in playlist are skipped.
+        Returns number of added entries.
+        """
+        count = len(self.list)
+        # path index is kept up to date, if it is built already
+        index = self.getPathIndex() if unique else self.__pathIndex
+        for ref in refs:
+            path = ref.getPath()
+            if unique and path in index:
+                continue
+            if index is not None:
+                index.setdefault(path, []).append(len(self.list))
+            if self.__refs is not None:
+                self.__refs.append(ref)
+            self.list.append(PlaylistEntryComponent(ref, STATE_NONE))
+        if refresh:
+            self.updateList()
+        return len(self.list) - count
+
     def isStopped(self):
         return self.state in (STATE_STOP, STATE_NONE)
 
     def PlayListShuffle(self):
         random.shuffle(self.list)
+        self._invalidate()
         self.l.setList(self.list)
         self.currPlaying = -1
         self.oldCurrPlaying = -1
 
 
+class MyFileList(FileList):
+    """
+    FileList which shows watched progress of files
+    """
+
+    def __init__(self, *args, **kwargs):
+        # path -> progress text, None when requested or unknown
+        self.progress = {}
+        # index -> appended progress entry
+        self.progressEntries = {}
+        FileList.__init__(self, *args, **kwargs)
+
+    def changeDir(self, directory, select=None):
+        self.resetProgress()
+        FileList.changeDir(self, directory, select)
+
+    def resetProgress(self):
+        for index, entry in self.progressEntries.items():
+            if index < len(self.list) and entry in self.list[index]:
+                self.list[index].remove(entry)
+                self.l.invalidateEntry(index)
+        self.progress = {}
+        self.progressEntries = {}
+
+    def getItemHeight(self):
+        try:
+            return self.l.getItemSize().height()
+        except Exception:
+            return 20
+
+    def getVisibleRange(self):
+        rows = 10
+        if self.instance is not None:
+            rows = max(1, self.instance.size().height() // self.getItemHeight())
+        index = self.getSelectionIndex()
+        start = index - index % rows
+        return start, min(start + rows, len(self.list))
+
+    def getProgressRequest(self):
+        """
+        Returns paths of visible files, which progress was not yet requested
+        """
+        paths = []
+        start, end = self.getVisibleRange()
+        for entry in self.list[start:end]:
+            ref, isDir = entry[0][:2]
+            if not isDir and ref is not None:
+                path = ref.getPath()
+                if path not in self.progress:
+                    self.progress[path] = None
+                    paths.append(path)
+        return paths
+
+    def setProgress(self, progress):
+        if not progress or self.instance is None:
+            return
+        for path, (position, duration) in progress.items():
+            if path not in self.progress:
+                # directory was changed meanwhile
+                continue
+            if duration:
+                self.progress[path] = "%d%%" % min(100, position * 100 // duration)
+            else:
+                self.progress[path] = "%d:%02d:%02d" % (position // 3600, position % 3600 // 60, position % 60)
+        width = self.instance.size().width()
+        height = self.getItemHeight()
+        start, end = self.getVisibleRange()
+        for index in range(start, end):
+            entry = self.list[index]
+            ref, isDir = entry[0][:2]
+            if isDir or ref is None or index in self.progressEntries:
+                continue
+            text = self.progress.get(ref.getPath())
+            if text is not None:
+                progressEntry = (eListboxPythonMultiContent.TYPE_TEXT, width - 100, 0, 90, height, 0, RT_HALIGN_RIGHT | RT_VALIGN_CENTER, text)
+                entry.append(progressEntry)
+                self.progressEntries[index] = progressEntry
+                self.l.invalidateEntry(index)
+
+
 class MediaPixmap(Pixmap):
     def __init__(self):
         Pixmap.__init__(self)
@@ -132,6 +356,12 @@ class MediaPlayerInfoBar(Screen):
 class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSeek, InfoBarAudioSelection, MyInfoBarCueSheetSupport, InfoBarExtensions, InfoBarPlugins, InfoBarNotifications, InfoBarAspectChange, HelpableScreen):
     ALLOW_SUSPEND = True
     ENABLE_RESUME_SUPPORT = True
+    CONTINUE_WATCHING_PAGE = 20
+    # cut lists of that many upcoming playlist entries are prefetched
+    PREFETCH_ENTRIES = 3
+    # time (s) spent per main loop iteration when adding directory to playlist
+    COPY_CHUNK_TIME = 0.05
+    COPY_REFRESH_TIME = 1
 
     def __init__(self, session, args=None):
         Screen.__init__(self, session)
@@ -158,7 +388,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
 
         # 'None' is magic to start at the list of mountpoints
         defaultDir = config.plugins.mediaplayer2.defaultDir.value
-        self.filelist = FileList(defaultDir or None, matchingPattern=r"(?i)^.*\.(mp2|mp3|ogg|ts|mts|m2ts|wav|wave|m3u|pls|e2pls|mpg|vob|avi|divx|m4v|mkv|mp4|m4a|dat|flac|flv|mov|dts|3gp|3g2|asf|wmv|wma|iso|webm)", useServiceRef=True, additionalExtensions="4098:m3u 4098:e2pls 4098:pls")
+        self.filelist = MyFileList(defaultDir or None, matchingPattern=FILELIST_PATTERN, useServiceRef=True, additionalExtensions="4098:m3u 4098:e2pls 4098:pls")
         self["filelist"] = self.filelist
 
         if config.plugins.mediaplayer2.useLibMedia.value:
@@ -261,6 +491,8 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         gaugeRenderers = mpGaugeRenderer and [mpGaugeRenderer] or []
         cueSheetForServicemp3 = config.plugins.mediaplayer2.cueSheetForServicemp3.value
         MyInfoBarCueSheetSupport.__init__(self, "MediaPlayerCueSheetActions", "mp2cuesheet", gaugeRenderers, cueSheetForServicemp3)
+        if cueSheetForServicemp3 and config.plugins.mediaplayer2.positionsMaintenanceOnStart.value and not CutList.maintenanceStarted:
+            self.runCueSheetMaintenance()
 
         self.onStopPlayback = [self.saveLastPositionIfEnabled]
         self.onStartPlayback = [self.saveLastPositionIfEnabled]
@@ -282,6 +514,13 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         self.hideMediaPlayerInfoBar = eTimer()
         self.hideMediaPlayerInfoBar.callback.append(self.timerHideMediaPlayerInfoBar)
 
+        # adding directory to playlist runs in chunks from main loop
+        self.copyWalker = None
+        self.copyTimer = eTimer()
+        self.copyTimer.callback.append(self.copyDirectoryChunk)
+        # directory being added must not fill a new playlist
+        self.playlist.onClear.append(self.cancelCopyDirectory)
+
         self.currList = "filelist"
         self.isAudioCD = False
         self.ext = None
@@ -292,9 +531,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         self.playlistIOInternal = PlaylistIOInternal()
         list = self.playlistIOInternal.open(resolveFilename(SCOPE_CONFIG, "playlist.e2pls"))
         if list:
-            for x in list:
-                self.playlist.addFile(x.ref)
-            self.playlist.updateList()
+            self.playlist.addFiles(x.ref for x in list)
 
         self.__event_tracker = ServiceEventTracker(screen=self, eventmap={
                 iPlayableService.evUpdatedInfo: self.__evUpdatedInfo,
@@ -414,6 +651,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             self.show()
 
     def __onClose(self):
+        self.cancelCopyDirectory()
         self.mediaPlayerInfoBar.doClose()
         self.statusScreen.doClose()
         self.session.nav.playService(self.oldService)
@@ -575,6 +813,8 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
 
     def switchToFileList(self):
         self.currList = "filelist"
+        # positions could be changed by playback
+        self.filelist.resetProgress()
         self.filelist.selectionEnabled(1)
         self.playlist.selectionEnabled(0)
         self.updateCurrentInfo()
@@ -611,6 +851,21 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             text = ref.getPath()
             return text.split('/')[-1]
 
+    def getEntryIdentifier(self, index):
+        ref, name, ext, isAudio = self.playlist.getEntryInfo(index)
+        if self.isAudioCD:
+            return ref.getName()
+        return name
+
+    def setPlaylistSummary(self, index, fields):
+        # entries from index on, in given LCD fields
+        count = len(self.playlist)
+        for offset, field in enumerate(fields):
+            if index + offset < count:
+                self.summaries.setText(self.getEntryIdentifier(index + offset), field)
+            else:
+                self.summaries.setText(" ", field)
+
     def updateCurrentInfo(self):  # Display current selected entry on LCD.
         if self.currList == "filelist":
             count = self.filelist.count()
@@ -632,21 +887,26 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
                 if serviceReference:
                     text = serviceReference.getPath()
                     self["currenttext"].setText(os.path.basename(text))
+            self.updateFileListProgress()
         if self.currList == "playlist":
-            entry = self.playlist.getSelection()
-            if entry:
-                text = self.getIdentifier(entry)
+            index = self.playlist.getSelectionIndex()
+            if self.playlist.getSelection():
+                text = self.getEntryIdentifier(index)
                 self.summaries.setText(text, 1)
                 self["currenttext"].setText(text)
-                count = self.playlist.count()
-                index = self.playlist.getCurrentIndex() + 1
-                for offset, field in enumerate([3, 4]):
-                    if index + offset < count:
-                        entry = self.playlist.getServiceRefList()[index + offset]
-                        text = self.getIdentifier(entry)
-                        self.summaries.setText(text, field)
-                    else:
-                        self.summaries.setText(" ", field)
+                self.prefetchPlaylistCutLists(index, 1)
+                self.setPlaylistSummary(self.playlist.getCurrentIndex() + 1, [3, 4])
+
+    def prefetchPlaylistCutLists(self, index, count):
+        if self.cueSheetForServicemp3 and not self.isAudioCD:
+            refs = self.playlist.getServiceRefList()[index:index + count]
+            self.prefetchCutLists([ref.getPath() for ref in refs if ref.type in (SERVICE_EXTEPLAYER3, SERVICE_GSTPLAYER, SERVICEMP3)])
+
+    def updateFileListProgress(self):
+        if self.cueSheetForServicemp3:
+            paths = self.filelist.getProgressRequest()
+            if paths:
+                self.cueSheetDAOCall('get_progress', (paths,), self.filelist.setProgress)
 
     def ok(self):
         if not self.shown:
@@ -720,6 +980,8 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             if config.plugins.mediaplayer2.contextMenuType.index >= 1:  # intermediate+
                 menu.append((_("Shuffle playlist"), "shuffle"))
                 menu.append((_("Show in filelist"), "showinfilelist"))
+        if self.cueSheetForServicemp3:
+            menu.append((_("Continue watching"), "continuewatching"))
         menu.append((_("Hide player"), "hide"))
         menu.append((_("Load playlist"), "loadplaylist"))
         if config.plugins.mediaplayer2.contextMenuType.index >= 1:  # intermediate+
@@ -737,17 +999,11 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         if choice[1] == "copydir":
             self.copyDirectory(self.filelist.getSelection()[0])
         elif choice[1] == "copydirplay":
-            self.copyDirectory(self.filelist.getSelection()[0])
-            if len(self.playlist) > 0:
-                self.switchToPlayList()
-                self.changeEntry(0)
+            self.copyDirectory(self.filelist.getSelection()[0], play=True, switch=True)
         elif choice[1] == "copyfiles":
             self.copyDirectory(os.path.dirname(self.filelist.getSelection()[0].getPath()) + "/", recursive=False)
         elif choice[1] == "copyfilesplay":
-            self.copyDirectory(os.path.dirname(self.filelist.getSelection()[0].getPath()) + "/", recursive=False)
-            if len(self.playlist) > 0:
-                self.switchToPlayList()
-                self.changeEntry(0)
+            self.copyDirectory(os.path.dirname(self.filelist.getSelection()[0].getPath()) + "/", recursive=False, play=True, switch=True)
         elif choice[1] == "playlist":
             self.switchToPlayList()
         elif choice[1] == "filelist":
@@ -774,6 +1030,8 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             self.session.openWithCallback(self.applySettings, MediaPlayerSettings, self)
         elif choice[1] == "audiocd":
             self.playAudioCD()
+        elif choice[1] == "continuewatching":
+            self.showContinueWatching()
         elif choice[1] == "playentry":
             self.playlist.setCurrentPlaying(self.playlist.getSelectionIndex())
             self.playEntry(choice[2])
@@ -788,15 +1046,42 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
                         break
                 self.filelist.changeDir(dirname, selection)
 
+    def showContinueWatching(self, before=None):
+        self.cueSheetDAOCall('get_recent', (self.CONTINUE_WATCHING_PAGE, before), boundFunction(self.continueWatchingLoaded, before))
+
+    def continueWatchingLoaded(self, before, recent):
+        if not recent:
+            if before is None:
+                self.session.open(MessageBox, _("There is nothing to continue watching"), type=MessageBox.TYPE_INFO, timeout=5)
+            return
+        menu = []
+        for path, position, duration, key in recent:
+            name = os.path.basename(path)
+            if duration:
+                name += " (%d%%)" % min(100, position * 100 // duration)
+            menu.append((name, path))
+        if len(recent) == self.CONTINUE_WATCHING_PAGE:
+            menu.append((_("More..."), None, recent[-1][3]))
+        self.session.openWithCallback(self.continueWatchingSelected, ChoiceBox, title=_("Continue watching"), list=menu)
+
+    def continueWatchingSelected(self, choice):
+        from enigma import eServiceReference
+        if choice is None:
+            return
+        if choice[1] is None:
+            self.showContinueWatching(choice[2])
+            return
+        self.playlist.addFiles((eServiceReference(4097, 0, choice[1]),))
+        self.switchToPlayList()
+        self.changeEntry(len(self.playlist) - 1)
+
     def playAudioCD(self):
         from enigma import eServiceReference
         if len(self.cdAudioTrackFiles):
             self.playlist.clear()
             self.savePlaylistOnExit = False
             self.isAudioCD = True
-            for file in self.cdAudioTrackFiles:
-                ref = eServiceReference(4097, 0, file)
-                self.playlist.addFile(ref)
+            self.playlist.addFiles(eServiceReference(4097, 0, file) for file in self.cdAudioTrackFiles)
             try:
                 from Plugins.Extensions.CDInfo.plugin import Query
                 cdinfo = Query(self)
@@ -884,9 +1169,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             if extension in self.playlistparsers:
                 playlist = self.playlistparsers[extension]()
                 list = playlist.open(path[1])
-                for x in list:
-                    self.playlist.addFile(x.ref)
-            self.playlist.updateList()
+                self.playlist.addFiles(x.ref for x in list)
 
     def delete_saved_playlist(self):
         listpath = []
@@ -919,21 +1202,61 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         self.playlist.clear()
         self.switchToFileList()
 
-    def copyDirectory(self, directory, recursive=True):
+    def copyDirectory(self, directory, recursive=True, play=False, switch=False):
+        """
+        Adds media files of directory to playlist in chunks from main loop,
+        with play set first playlist entry is played as soon as it is there,
+        with switch set also playlist is shown then
+        """
         print("copyDirectory", directory)
         if directory == '/':
             print("refusing to operate on /")
             return
-        filelist = FileList(directory, useServiceRef=True, showMountpoints=False, isTop=True)
-
-        for x in filelist.getFileList():
-            if x[0][1]:  # isDir
-                if recursive:
-                    if x[0][0] != directory:
-                        self.copyDirectory(x[0][0])
-            elif filelist.getServiceRef() and filelist.getServiceRef().type == 4097:
-                self.playlist.addFile(x[0][0])
-        self.playlist.updateList()
+        self.cancelCopyDirectory()
+        self.copyWalker = walkMediaFiles(directory, recursive)
+        self.copyPlay = play
+        self.copySwitch = switch
+        self.copyCount = 0
+        self.copyRefresh = 0
+        self.copyDirectoryChunk()
+
+    def copyDirectoryChunk(self):
+        from enigma import eServiceReference
+        deadline = time.monotonic() + self.COPY_CHUNK_TIME
+        refs = []
+        for path in self.copyWalker:
+            if path is not None:
+                refs.append(eServiceReference(4097, 0, path))
+                # first file to play should not wait for the whole chunk
+                if self.copyPlay:
+                    break
+            if time.monotonic() > deadline:
+                break
+        else:
+            self.copyWalker = None
+        self.copyCount += len(refs)
+        # refreshing the whole list is expensive, do it only from time to time
+        refresh = self.copyWalker is None or (refs and (self.copyPlay or time.monotonic() > self.copyRefresh))
+        self.playlist.addFiles(refs, refresh=refresh)
+        if refresh:
+            self.copyRefresh = time.monotonic() + self.COPY_REFRESH_TIME
+        if self.copyPlay and len(self.playlist) > 0:
+            self.copyPlay = False
+            if self.copySwitch:
+                self.switchToPlayList()
+            self.changeEntry(0)
+        if self.copyWalker is not None:
+            self.statusScreen.setStatus(_("Adding to playlist: %d files") % self.copyCount)
+            self.copyTimer.start(0, True)
+        else:
+            print("copyDirectory finished, %d files added" % self.copyCount)
+
+    def cancelCopyDirectory(self):
+        self.copyTimer.stop()
+        if self.copyWalker is not None:
+            self.copyWalker.close()
+            self.copyWalker = None
+            print("copyDirectory cancelled, %d files added" % self.copyCount)
 
     def deleteFile(self):
         if self.currList == "filelist":
@@ -977,17 +1300,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
     def removeListEntry(self):
         currdir = self.filelist.getCurrentDirectory()
         self.filelist.changeDir(currdir)
-        deleteend = False
-        while not deleteend:
-            index = 0
-            deleteend = True
-            if len(self.playlist) > 0:
-                for x in self.playlist.list:
-                    if self.service == x[0]:
-                        self.playlist.deleteFile(index)
-                        deleteend = False
-                        break
-                    index += 1
+        self.playlist.deleteRef(self.service)
         self.playlist.updateList()
         if self.currList == "playlist":
             if len(self.playlist) == 0:
@@ -1000,12 +1313,9 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             if extension in self.playlistparsers:
                 playlist = self.playlistparsers[extension]()
                 list = playlist.open(ServiceRef.getPath())
-                for x in list:
-                    self.playlist.addFile(x.ref)
-            self.playlist.updateList()
+                self.playlist.addFiles(x.ref for x in list)
         else:
-            self.playlist.addFile(self.filelist.getServiceRef())
-            self.playlist.updateList()
+            self.playlist.addFiles((self.filelist.getServiceRef(),))
             if len(self.playlist) == 1:
                 self.changeEntry(0)
 
@@ -1023,7 +1333,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             self.stopEntry()
 
     def nextMarkOrEntry(self):
-        if not self.jumpPreviousNextMark(lambda x: x):
+        if not self.jumpPreviousNextMark(CutPointDistance(1)):
             next = self.playlist.getCurrentIndex() + 1
             if next < len(self.playlist):
                 self.changeEntry(next)
@@ -1031,7 +1341,7 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
                 self.doSeek(-1)
 
     def previousMarkOrEntry(self):
-        if not self.jumpPreviousNextMark(lambda x: -x - 5 * 90000, start=True):
+        if not self.jumpPreviousNextMark(CutPointDistance(-1, 5 * 90000), start=True):
             next = self.playlist.getCurrentIndex() - 1
             if next >= 0:
                 self.changeEntry(next)
@@ -1047,11 +1357,9 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
         self.playEntry()
 
     def playServiceRefEntry(self, serviceref):
-        serviceRefList = self.playlist.getServiceRefList()
-        for count in range(len(serviceRefList)):
-            if serviceRefList[count] == serviceref:
-                self.changeEntry(count)
-                break
+        index = self.playlist.findRef(serviceref)
+        if index >= 0:
+            self.changeEntry(index)
 
     def xplayEntry(self):
         if self.currList == "playlist":
@@ -1063,8 +1371,9 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
             sel = self.filelist.getSelection()
             if sel:
                 if sel[1]:  # can descent
-                    # add directory to playlist
-                    self.copyDirectory(sel[0])
+                    # add directory to playlist, it starts playing itself
+                    self.copyDirectory(sel[0], play=True)
+                    return
                 else:
                     # add file to playlist
                     self.copyFile()
@@ -1074,14 +1383,18 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
 
     def playEntry(self, stype=None):
         from enigma import eServiceReference
-        if len(self.playlist.getServiceRefList()):
+        if len(self.playlist):
             needsInfoUpdate = False
-            currref = self.playlist.getServiceRefList()[self.playlist.getCurrentIndex()]
+            idx = self.playlist.getCurrentIndex()
+            entryref, name, self.ext, isAudio = self.playlist.getEntryInfo(idx)
+            currref = entryref
             if stype is not None:
                 currref = eServiceReference(stype, 0, currref.getPath())
             elif currref.type in (SERVICE_EXTEPLAYER3, SERVICE_GSTPLAYER, SERVICEMP3):
                 currref = eServiceReference(self.libMedia, 0, currref.getPath())
             if self.session.nav.getCurrentlyPlayingServiceReference() is None or currref != self.session.nav.getCurrentlyPlayingServiceReference() or self.playlist.isStopped():
+                # db reads run while previous entry is saved and service starts
+                self.prefetchPlaylistCutLists(idx, 1 + self.PREFETCH_ENTRIES)
                 for f in self.onStartPlayback:
                     f()
                 # reset subtitles and load external subtitles if available
@@ -1097,48 +1410,24 @@ class MediaPlayer(Screen, InfoBarBase, SubsSupportStatus, SubsSupport, InfoBarSe
                 description = info and info.getInfoString(currref, iServiceInformation.sDescription) or ""
                 self["title"].setText(description)
                 # display just playing musik on LCD
-                idx = self.playlist.getCurrentIndex()
-                currref = self.playlist.getServiceRefList()[idx]
-                text = self.getIdentifier(currref)
-                self.ext = os.path.splitext(text)[1].lower()
-                text = ">" + text
                 # FIXME: the information if the service contains video (and we should hide our window) should com from the service instead
-                if self.ext not in AUDIO_EXTENSIONS and not self.isAudioCD:
+                if not isAudio and not self.isAudioCD:
                     self.hideAndInfoBar()
                 else:
                     needsInfoUpdate = True
-                self.summaries.setText(text, 1)
+                self.summaries.setText(">" + self.getEntryIdentifier(idx), 1)
 
                 # get the next two entries
-                idx += 1
-                if idx < len(self.playlist):
-                    currref = self.playlist.getServiceRefList()[idx]
-                    text = self.getIdentifier(currref)
-                    self.summaries.setText(text, 3)
-                else:
-                    self.summaries.setText(" ", 3)
-
-                idx += 1
-                if idx < len(self.playlist):
-                    currref = self.playlist.getServiceRefList()[idx]
-                    text = self.getIdentifier(currref)
-                    self.summaries.setText(text, 4)
-                else:
-                    self.summaries.setText(" ", 4)
+                self.setPlaylistSummary(idx + 1, [3, 4])
             else:
-                idx = self.playlist.getCurrentIndex()
-                currref = self.playlist.getServiceRefList()[idx]
-                text = currref.getPath()
-                self.ext = os.path.splitext(text)[1].lower()
-                if self.ext not in AUDIO_EXTENSIONS and not self.isAudioCD:
+                if not isAudio and not self.isAudioCD:
                     self.hideAndInfoBar()
                 else:
                     needsInfoUpdate = True
 
             self.unPauseService()
             if needsInfoUpdate == True:
-                path = self.playlist.getServiceRefList()[self.playlist.getCurrentIndex()].getPath()
-                self["coverArt"].updateCoverArt(path)
+                self["coverArt"].updateCoverArt(entryref.getPath())
             else:
                 self["coverArt"].showDefaultCover()
             self.readTitleInformation()
@@ -1348,14 +1637,7 @@ def filescan_open(list, session, **kwargs):
     mp = session.open(MediaPlayer)
     mp.playlist.clear()
     mp.savePlaylistOnExit = False
-
-    for file in list:
-        if file.mimetype == "video/MP2T":
-            stype = 1
-        else:
-            stype = 4097
-        ref = eServiceReference(stype, 0, file.path)
-        mp.playlist.addFile(ref)
+    mp.playlist.addFiles(eServiceReference(file.mimetype == "video/MP2T" and 1 or 4097, 0, file.path) for file in list)
 
     mp.changeEntry(0)
     mp.switchToPlayList()
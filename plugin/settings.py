@@ -7,9 +7,11 @@ from Components.Sources.StaticText import StaticText
 from Components.config import config, getConfigListEntry, ConfigSubsection, \
     ConfigYesNo, ConfigOnOff, ConfigDirectory, ConfigSelection, ConfigNothing, \
     ConfigInteger
+from Screens.ChoiceBox import ChoiceBox
 from Screens.HelpMenu import HelpableScreen
 from Screens.MessageBox import MessageBox
 from Screens.Screen import Screen
+from Tools.BoundFunction import boundFunction
 
 from . import _
 from enigma import eEnv
@@ -27,6 +29,11 @@ config.plugins.mediaplayer2.extensionsMenu = ConfigYesNo(default=False)
 config.plugins.mediaplayer2.mainMenu = ConfigYesNo(default=False)
 config.plugins.mediaplayer2.cueSheetForServicemp3 = ConfigOnOff(default=True)
 config.plugins.mediaplayer2.saveLastPosition = ConfigYesNo(default=True)
+config.plugins.mediaplayer2.positionCheckpointInterval = ConfigInteger(10, (0, 600))
+config.plugins.mediaplayer2.cutListCacheSize = ConfigInteger(50, (0, 1000))
+config.plugins.mediaplayer2.positionsMaintenanceOnStart = ConfigYesNo(default=False)
+config.plugins.mediaplayer2.positionsRetentionDays = ConfigInteger(0, (0, 3650))
+config.plugins.mediaplayer2.positionsRetentionCount = ConfigInteger(0, (0, 100000))
 config.plugins.mediaplayer2.onMovieStart = ConfigSelection(default="resume", choices=[
         ("ask yes", _("Ask user") + " " + _("default") + " " + _("yes")),
         ("ask no", _("Ask user") + " " + _("default") + " " + _("no")),
@@ -111,6 +118,19 @@ def ServiceGstPlayerApplySettings():
     serviceapp_client.setUseUserSettings()
 
 
+def getMountPrefixes():
+    prefixes = []
+    for root in ('/media/', '/mnt/'):
+        try:
+            names = sorted(os.listdir(root))
+        except OSError:
+            continue
+        for name in names:
+            if os.path.ismount(root + name):
+                prefixes.append(root + name + '/')
+    return prefixes
+
+
 class DirectoryBrowser(Screen, HelpableScreen):
 
     def __init__(self, session, currDir):
@@ -169,6 +189,10 @@ class MediaPlayerSettings(Screen, ConfigListScreen):
         ConfigListScreen.__init__(self, [], session=session, on_change=self.changedEntry)
         self.parent = parent
         self.removeAllPositionsCfg = ConfigNothing()
+        self.cleanupPositionsCfg = ConfigNothing()
+        self.remapPositionsCfg = ConfigNothing()
+        self.importCutsCfg = ConfigNothing()
+        self.exportCutsCfg = ConfigNothing()
         self.initConfigList()
         config.plugins.mediaplayer2.saveDirOnExit.addNotifier(self.initConfigList)
         config.plugins.mediaplayer2.libMedia.addNotifier(self.initConfigList)
@@ -206,7 +230,16 @@ class MediaPlayerSettings(Screen, ConfigListScreen):
                 self.list.append(getConfigListEntry(_("cuesheets for servicemp3 (restart plugin)"), config.plugins.mediaplayer2.cueSheetForServicemp3))
                 if config.plugins.mediaplayer2.cueSheetForServicemp3.value:
                     self.list.append(getConfigListEntry(_("remove all saved positions"), self.removeAllPositionsCfg))
+                    self.list.append(getConfigListEntry(_("remove saved positions older than (days, 0 = never)"), config.plugins.mediaplayer2.positionsRetentionDays))
+                    self.list.append(getConfigListEntry(_("max. number of saved positions (0 = unlimited)"), config.plugins.mediaplayer2.positionsRetentionCount))
+                    self.list.append(getConfigListEntry(_("clean up saved positions on start"), config.plugins.mediaplayer2.positionsMaintenanceOnStart))
+                    self.list.append(getConfigListEntry(_("clean up saved positions now"), self.cleanupPositionsCfg))
+                    self.list.append(getConfigListEntry(_("move saved positions to other device"), self.remapPositionsCfg))
+                    self.list.append(getConfigListEntry(_("import saved positions from .cuts files"), self.importCutsCfg))
+                    self.list.append(getConfigListEntry(_("export saved positions to .cuts files"), self.exportCutsCfg))
             self.list.append(getConfigListEntry(_("save last position (restart plugin)"), config.plugins.mediaplayer2.saveLastPosition))
+            if config.plugins.mediaplayer2.cueSheetForServicemp3.value:
+                self.list.append(getConfigListEntry(_("protect position against crash every (s, 0 = off)"), config.plugins.mediaplayer2.positionCheckpointInterval))
             self.list.append(getConfigListEntry(_("on movie start (restart plugin)"), config.plugins.mediaplayer2.onMovieStart))
             self.list.append(getConfigListEntry(_("LCD on video playback"), config.plugins.mediaplayer2.lcdOnVideoPlayback))
             self.list.append(getConfigListEntry(_("show in extensions menu"), config.plugins.mediaplayer2.extensionsMenu))
@@ -239,14 +272,94 @@ class MediaPlayerSettings(Screen, ConfigListScreen):
         elif self["config"].getCurrent()[1] == self.removeAllPositionsCfg:
             message = _("Do you really want to delete all saved positions?")
             self.session.openWithCallback(self.removeDbCB, MessageBox, message, type=MessageBox.TYPE_YESNO)
+        elif self["config"].getCurrent()[1] == self.cleanupPositionsCfg:
+            self.parent.runCueSheetMaintenance(self.maintenanceCB)
+        elif self["config"].getCurrent()[1] == self.remapPositionsCfg:
+            self.parent.cueSheetDAOCall('detect_remaps', (getMountPrefixes(),), self.remapsDetected)
+        elif self["config"].getCurrent()[1] == self.importCutsCfg:
+            self.session.openWithCallback(boundFunction(self.cutsDirectorySelected, 'import_cuts'), DirectoryBrowser, self.parent.filelist.getCurrentDirectory())
+        elif self["config"].getCurrent()[1] == self.exportCutsCfg:
+            self.session.openWithCallback(boundFunction(self.cutsDirectorySelected, 'export_cuts'), DirectoryBrowser, self.parent.filelist.getCurrentDirectory())
+
+    def cutsDirectorySelected(self, method, path):
+        if path:
+            self.parent.cueSheetDAOCall(method, (path,), boundFunction(self.cutsDone, method), invalidate=method == 'import_cuts')
+
+    def cutsDone(self, method, count):
+        if count is None:
+            message = _("Transfer of saved positions failed!")
+        elif method == 'import_cuts':
+            message = _("Imported saved positions of %d files") % count
+        else:
+            message = _("Exported saved positions of %d files") % count
+        self.session.open(MessageBox, message, type=MessageBox.TYPE_INFO, timeout=5)
+
+    def remapsDetected(self, remaps):
+        choices = [("%s -> %s (%d)" % (old, new, count), (old, new)) for old, new, count in remaps or []]
+        choices.append((_("Select manually..."), None))
+        self.session.openWithCallback(self.remapSelected, ChoiceBox, title=_("Move saved positions"), list=choices)
+
+    def remapSelected(self, choice):
+        if choice is None:
+            return
+        if choice[1] is None:
+            self.parent.cueSheetDAOCall('get_path_prefixes', (), self.remapPrefixesLoaded)
+        else:
+            self.remapConfirm(*choice[1])
+
+    def remapPrefixesLoaded(self, prefixes):
+        if not prefixes:
+            self.session.open(MessageBox, _("There are no saved positions on removable devices"), type=MessageBox.TYPE_INFO, timeout=5)
+            return
+        choices = [("%s (%d)" % (prefix, count), prefix) for prefix, count in prefixes]
+        self.session.openWithCallback(self.remapOldSelected, ChoiceBox, title=_("Move saved positions from"), list=choices)
+
+    def remapOldSelected(self, choice):
+        if choice is None:
+            return
+        choices = [(prefix, (choice[1], prefix)) for prefix in getMountPrefixes() if prefix != choice[1]]
+        self.session.openWithCallback(self.remapNewSelected, ChoiceBox, title=_("Move saved positions to"), list=choices)
+
+    def remapNewSelected(self, choice):
+        if choice is not None:
+            self.remapConfirm(*choice[1])
+
+    def remapConfirm(self, old, new):
+        self.parent.cueSheetDAOCall('remap_prefix', (old, new, True), boundFunction(self.remapCounted, old, new))
+
+    def remapCounted(self, old, new, count):
+        if not count:
+            return
+        message = _("Do you really want to move %d saved positions from %s to %s?") % (count, old, new)
+        self.session.openWithCallback(boundFunction(self.remapConfirmed, old, new), MessageBox, message, type=MessageBox.TYPE_YESNO)
+
+    def remapConfirmed(self, old, new, answer):
+        if answer:
+            self.parent.cueSheetDAOCall('remap_prefix', (old, new), self.remapDone, invalidate=True)
+
+    def remapDone(self, count):
+        if count is None:
+            message = _("Moving of saved positions failed!")
+        else:
+            message = _("Moved %d saved positions") % count
+        self.session.open(MessageBox, message, type=MessageBox.TYPE_INFO, timeout=5)
+
+    def maintenanceCB(self, stats):
+        if stats is None:
+            message = _("Clean up of saved positions failed!")
+        else:
+            message = _("Removed %d saved positions, reclaimed %d kB") % (stats['pruned'] + stats['expired'], stats['bytes_reclaimed'] // 1024)
+        self.session.open(MessageBox, message, type=MessageBox.TYPE_INFO, timeout=5)
 
     def removeDbCB(self, answer):
         if answer:
-            from util import CueSheetDAO
+            from .util import CueSheetDAO
             try:
                 CueSheetDAO.instance.clean_db()
             except Exception as e:
                 print(str(e))
+            else:
+                self.parent.invalidateCutLists()
 
     def DirectoryBrowserClosed(self, path):
         print("PathBrowserClosed:" + str(path))
@@ -1,8 +1,403 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+import hashlib
+import mmap
 import os
+import queue
+import struct
+import threading
+import time
 import traceback
+import zlib
 import sqlite3
 
-DB_VERSION = 1
+# schema version is kept in user_version pragma, the file name is frozen
+# to its original v1 name so saved positions survive schema upgrades
+DB_NAME_VERSION = 1
+
+# ordered schema migrations, MIGRATIONS[n] upgrades schema from version n to n + 1
+MIGRATIONS = (
+    (
+        """create table if not exists cuesheet (
+            id               integer primary key autoincrement not null,
+            path         text unique
+        )""",
+        """create table if not exists mark (
+            id                            integer primary key autoincrement not null,
+            time                       integer,
+            type                       integer,
+            cuesheet_id         integer not null references cuesheet(id),
+            UNIQUE (time, cuesheet_id) ON CONFLICT IGNORE
+        )""",
+    ),
+    (
+        "create index if not exists mark_cuesheet_id on mark (cuesheet_id, time)",
+    ),
+    (
+        "alter table cuesheet add column last_updated integer",
+        "update cuesheet set last_updated = strftime('%s', 'now')",
+        "create index if not exists cuesheet_last_updated on cuesheet (last_updated)",
+    ),
+    (
+        "alter table cuesheet add column identity text",
+        "create index if not exists cuesheet_identity on cuesheet (identity)",
+    ),
+    (
+        "alter table cuesheet add column duration integer",
+    ),
+    (
+        "alter table cuesheet add column last_played integer",
+        # best guess for files played before, their LAST (type 3) mark is written on stop
+        "update cuesheet set last_played = last_updated where id in (select cuesheet_id from mark where type = 3)",
+        "create index if not exists cuesheet_last_played on cuesheet (last_played)",
+    ),
+)
+
+CUT_TYPE_LAST = 3
+
+DB_VERSION = len(MIGRATIONS)
+
+# number of prepared statements sqlite3 keeps compiled per connection
+CACHED_STATEMENTS = 32
+
+PRAGMAS = (
+    # only takes effect for a new db, existing ones keep their free pages,
+    # converting them needs a full vacuum which rewrites the whole file
+    "pragma auto_vacuum = incremental",
+    "pragma journal_mode = wal",
+    # with wal, normal is still safe against corruption and avoids fsync on every commit
+    "pragma synchronous = normal",
+    "pragma mmap_size = %d" % (4 * 1024 * 1024),
+    "pragma temp_store = memory",
+)
+
+# files under these directories may just be on unmounted device
+MOUNT_ROOTS = ('/media/', '/mnt/', '/autofs/', '/net/')
+
+# size of file head and tail used for content identity
+IDENTITY_CHUNK = 64 * 1024
+IDENTITY_CACHE_SIZE = 512
+
+_identityCache = OrderedDict()
+_identityLock = threading.Lock()
+
+
+def get_content_identity(path):
+    """
+    Returns identity of file content, which survives renames, moves and
+    different mount points, computed from file size and hash of its
+    first and last IDENTITY_CHUNK bytes.
+
+    Identities are cached per (path, mtime, size), returns None
+    for streams and unreadable files.
+    """
+    if not path.startswith('/'):
+        return None
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _identityLock:
+        identity = _identityCache.get(key)
+        if identity is not None:
+            _identityCache.move_to_end(key)
+            return identity
+    size = st.st_size
+    try:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            if size <= 2 * IDENTITY_CHUNK:
+                data = os.pread(fd, size, 0)
+            else:
+                data = os.pread(fd, IDENTITY_CHUNK, 0) + os.pread(fd, IDENTITY_CHUNK, size - IDENTITY_CHUNK)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        print('[CueSheetDAO] cannot compute identity of %s: %s' % (path, str(e)))
+        return None
+    identity = "%x:%s" % (size, hashlib.sha1(data).hexdigest())
+    with _identityLock:
+        _identityCache[key] = identity
+        while len(_identityCache) > IDENTITY_CACHE_SIZE:
+            _identityCache.popitem(last=False)
+    return identity
+
+
+# record of enigma2 .cuts file, big endian pts and type
+CUTS_RECORD = struct.Struct('>QI')
+
+
+def read_cuts_file(path):
+    """
+    Returns list of (pts, type) stored in enigma2 .cuts file
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        # ignore truncated record
+        size -= size % CUTS_RECORD.size
+        if size == 0:
+            return []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            with memoryview(m) as view:
+                return list(CUTS_RECORD.iter_unpack(view[:size]))
+
+
+def write_cuts_file(path, cutlist):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(b''.join(CUTS_RECORD.pack(pts, type) for pts, type in cutlist))
+    os.rename(tmp_path, path)
+
+
+class PositionCheckpoint(object):
+    """
+    Ring of playback position checkpoints in a small memory mapped file.
+
+    A checkpoint is a plain store into the shared mapping, so it survives
+    a crash of enigma2 without any syscall. The mapping is synced to disk
+    only every syncEvery checkpoints, a power loss costs at most that many.
+    Each slot carries crc32 of its content, torn slots are ignored.
+    """
+    SLOTS = 16
+    SLOT_SIZE = 512
+    CRC = struct.Struct('<I')
+    # sequence, timestamp, position (pts), duration (pts, -1 unknown), path length
+    HEADER = struct.Struct('<QdqqH')
+
+    def __init__(self, path, syncEvery=6):
+        self.path = path
+        self.syncEvery = syncEvery
+        self.mmap = None
+        self.sequence = 0
+        self.written = 0
+
+    def open(self):
+        if self.mmap is not None:
+            return
+        size = self.SLOTS * self.SLOT_SIZE
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, size)
+            self.mmap = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self.sequence = max([checkpoint[0] for checkpoint in self.read()] or [0])
+
+    def read(self):
+        """
+        Returns valid checkpoints as list of (sequence, timestamp, path, position, duration)
+        ordered by sequence, duration is None when unknown
+        """
+        self.open()
+        checkpoints = []
+        for offset in range(0, self.SLOTS * self.SLOT_SIZE, self.SLOT_SIZE):
+            crc = self.CRC.unpack_from(self.mmap, offset)[0]
+            sequence, timestamp, position, duration, length = self.HEADER.unpack_from(self.mmap, offset + self.CRC.size)
+            if sequence == 0 or not 0 < length <= self.SLOT_SIZE - self.CRC.size - self.HEADER.size:
+                continue
+            body = self.mmap[offset + self.CRC.size:offset + self.CRC.size + self.HEADER.size + length]
+            if zlib.crc32(body) != crc:
+                continue
+            path = body[self.HEADER.size:].decode('utf-8', 'replace')
+            checkpoints.append((sequence, timestamp, path, position, duration >= 0 and duration or None))
+        checkpoints.sort()
+        return checkpoints
+
+    def latest(self):
+        """
+        Returns {path: (sequence, timestamp, position, duration)} of newest checkpoint of each path
+        """
+        return dict((path, (sequence, timestamp, position, duration)) for sequence, timestamp, path, position, duration in self.read())
+
+    def write(self, path, position, duration=None):
+        self.open()
+        data = path.encode('utf-8')
+        if len(data) > self.SLOT_SIZE - self.CRC.size - self.HEADER.size:
+            return False
+        self.sequence += 1
+        body = self.HEADER.pack(self.sequence, time.time(), position, duration or -1, len(data)) + data
+        offset = (self.sequence % self.SLOTS) * self.SLOT_SIZE
+        # write crc last, so slot is either old, new or invalid
+        self.CRC.pack_into(self.mmap, offset, 0)
+        self.mmap[offset + self.CRC.size:offset + self.CRC.size + len(body)] = body
+        self.CRC.pack_into(self.mmap, offset, zlib.crc32(body))
+        self.written += 1
+        if self.syncEvery and self.written % self.syncEvery == 0:
+            self.mmap.flush()
+        return True
+
+    def clear(self, sequence=None):
+        """
+        Invalidates checkpoints up to sequence, all when sequence is None
+        """
+        self.open()
+        for offset in range(0, self.SLOTS * self.SLOT_SIZE, self.SLOT_SIZE):
+            if sequence is None or self.HEADER.unpack_from(self.mmap, offset + self.CRC.size)[0] <= sequence:
+                self.mmap[offset:offset + self.SLOT_SIZE] = bytes(self.SLOT_SIZE)
+        self.mmap.flush()
+
+    def close(self):
+        if self.mmap is not None:
+            self.mmap.flush()
+            self.mmap.close()
+            self.mmap = None
+
+
+# upper bounds (ms) of timing histogram buckets, the last bucket is unbounded
+TIMING_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# operations slower than this (ms) are logged with their statements
+SLOW_QUERY_THRESHOLD = 100
+# at most this many statements are kept per operation, the rest is only counted
+SLOW_QUERY_STATEMENTS = 20
+
+
+class CueSheetStats(object):
+    """
+    Thread safe timing histograms of db operations
+    """
+
+    def __init__(self, slowThreshold=SLOW_QUERY_THRESHOLD):
+        self.slowThreshold = slowThreshold
+        self.lock = threading.Lock()
+        self.timings = {}
+        self.slow = 0
+
+    def add(self, name, elapsed, path=None, statements=None, log=True, skipped=0):
+        elapsed *= 1000
+        with self.lock:
+            timing = self.timings.get(name)
+            if timing is None:
+                timing = self.timings[name] = {'count': 0, 'total': 0.0, 'max': 0.0, 'histogram': [0] * (len(TIMING_BUCKETS) + 1)}
+            timing['count'] += 1
+            timing['total'] += elapsed
+            timing['max'] = max(timing['max'], elapsed)
+            timing['histogram'][bisect_left(TIMING_BUCKETS, elapsed)] += 1
+            slow = log and self.slowThreshold and elapsed >= self.slowThreshold
+            if slow:
+                self.slow += 1
+        if slow:
+            print('[CueSheetDAO] slow %s (%.1f ms) for %s' % (name, elapsed, path))
+            for statement in statements or ():
+                print('[CueSheetDAO]     %s' % ' '.join(statement.split()))
+            if skipped:
+                print('[CueSheetDAO]     ... %d more statements' % skipped)
+
+    def snapshot(self):
+        """
+        Returns {name: {count, total, max, avg, histogram}} with times in ms,
+        histogram is list of (upper bound, count), last bound is None
+        """
+        with self.lock:
+            snapshot = {}
+            for name, timing in self.timings.items():
+                snapshot[name] = {
+                    'count': timing['count'],
+                    'total': timing['total'],
+                    'max': timing['max'],
+                    'avg': timing['total'] / timing['count'],
+                    'histogram': list(zip(TIMING_BUCKETS + (None,), timing['histogram'])),
+                }
+            return {'timings': snapshot, 'slow': self.slow, 'slowThreshold': self.slowThreshold}
+
+    def reset(self):
+        with self.lock:
+            self.timings.clear()
+            self.slow = 0
+
+    def dump(self):
+        snapshot = self.snapshot()
+        for name, timing in sorted(snapshot['timings'].items()):
+            print('[CueSheetDAO] %s: %d calls, avg %.2f ms, max %.2f ms' % (name, timing['count'], timing['avg'], timing['max']))
+        print('[CueSheetDAO] %d operations slower than %d ms' % (snapshot['slow'], snapshot['slowThreshold']))
+
+
+class CueSheetConnection(object):
+    """
+    Long-lived sqlite3 connection shared by all users of one db file.
+
+    Use it as context manager, it holds the lock and returns
+    the (lazily opened) sqlite3 connection:
+
+        with CueSheetConnection.get(db_path) as conn:
+            conn.execute(...)
+    """
+    pool = {}
+    poolLock = threading.Lock()
+
+    @classmethod
+    def get(cls, db_path):
+        with cls.poolLock:
+            connection = cls.pool.get(db_path)
+            if connection is None:
+                connection = cls.pool[db_path] = cls(db_path)
+            return connection
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.RLock()
+        self.conn = None
+        self.stats = CueSheetStats()
+        # statements executed by the current thread within timed()
+        self.trace = threading.local()
+
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            return self.connect()
+        except Exception:
+            self.lock.release()
+            raise
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.lock.release()
+
+    def connect(self):
+        if self.conn is None:
+            start = time.monotonic()
+            conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=CACHED_STATEMENTS)
+            for pragma in PRAGMAS:
+                conn.execute(pragma).fetchall()
+            conn.set_trace_callback(self.traceStatement)
+            self.conn = conn
+            self.stats.add('connect', time.monotonic() - start, self.db_path)
+        return self.conn
+
+    def traceStatement(self, statement):
+        statements = getattr(self.trace, 'statements', None)
+        if statements is not None:
+            if len(statements) < SLOW_QUERY_STATEMENTS:
+                statements.append(statement)
+            else:
+                self.trace.skipped += 1
+
+    @contextmanager
+    def timed(self, name, path=None):
+        """
+        Records duration of the enclosed operation under name,
+        nested operations share statements of the outermost one
+        """
+        outermost = getattr(self.trace, 'statements', None) is None
+        if outermost:
+            self.trace.statements = []
+            self.trace.skipped = 0
+        statements = self.trace.statements
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            skipped = self.trace.skipped
+            if outermost:
+                self.trace.statements = None
+            self.stats.add(name, time.monotonic() - start, path, statements, log=outermost, skipped=skipped)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
 
 
 class CueSheetDAO(object):
@@ -10,80 +405,545 @@ class CueSheetDAO(object):
 
     def __init__(self, db_path):
         CueSheetDAO.instance = self
-        self.db_path = "%s_v%d.db" % (os.path.splitext(db_path)[0], DB_VERSION)
-        db_is_new = not os.path.exists(self.db_path)
+        self.db_path = "%s_v%d.db" % (os.path.splitext(db_path)[0], DB_NAME_VERSION)
+        self.connection = CueSheetConnection.get(self.db_path)
+        self.stats = self.connection.stats
         print('[CueSheetDAO] init', self.db_path)
-        if db_is_new:
-            print('[CueSheetDAO] creating schema')
-            self.create_schema()
-        else:
-            print('[CueSheetDAO] database exists, assume schema does, too.')
-
-    def create_schema(self):
-        with sqlite3.connect(self.db_path) as conn:
-            schema = """
-                create table cuesheet (
-                    id               integer primary key autoincrement not null,
-                    path         text unique
-                );
-
-                create table mark (
-                    id                            integer primary key autoincrement not null,
-                    time                       integer,
-                    type                       integer,
-                    cuesheet_id         integer not null references cuesheet(id),
-                    UNIQUE (time, cuesheet_id) ON CONFLICT IGNORE
-                );
-            """
-            conn.executescript(schema)
+        self.migrate()
+
+    def get_stats(self):
+        """
+        Returns snapshot of timing statistics, see CueSheetStats.snapshot
+        """
+        return self.stats.snapshot()
+
+    def migrate(self):
+        with self.connection as conn:
+            version = conn.execute("pragma user_version").fetchone()[0]
+            if version == 0 and conn.execute("select 1 from sqlite_master where type = 'table' and name = 'cuesheet'").fetchone():
+                # created before migrations were introduced
+                version = 1
+            if version > DB_VERSION:
+                print('[CueSheetDAO] schema version %d is newer than supported %d!' % (version, DB_VERSION))
+                return
+            for version in range(version, DB_VERSION):
+                print('[CueSheetDAO] migrating schema to version %d' % (version + 1))
+                try:
+                    conn.execute("begin")
+                    for statement in MIGRATIONS[version]:
+                        conn.execute(statement)
+                    conn.execute("pragma user_version = %d" % (version + 1))
+                except Exception:
+                    conn.rollback()
+                    raise
+                else:
+                    conn.commit()
 
     def clean_db(self):
-        try:
-            os.remove(self.db_path)
-        except OSError as e:
-            print('[CueSheetDAO] error when cleaning db', str(e))
-            return False
-        else:
-            self.create_schema()
-            return True
+        with self.connection, self.connection.timed('clean_db', self.db_path):
+            self.connection.close()
+            try:
+                os.remove(self.db_path)
+            except OSError as e:
+                print('[CueSheetDAO] error when cleaning db', str(e))
+                return False
+            else:
+                for suffix in ('-wal', '-shm'):
+                    try:
+                        os.remove(self.db_path + suffix)
+                    except OSError:
+                        pass
+                self.migrate()
+                return True
+
+    def get_cut_list(self, path, by_identity=True):
+        """
+        Returns marks of path, when path is unknown and by_identity is set,
+        returns marks of the same file stored under different path
+        """
+        with self.connection.timed('get_cut_list', path):
+            return self._get_cut_list(path, by_identity)
 
-    def get_cut_list(self, path):
+    def _get_cut_list(self, path, by_identity):
         print('[CueSheetDAO] getCutList for %s' % path)
-        with sqlite3.connect(self.db_path) as conn:
-            conn.row_factory = sqlite3.Row
-            cutlist = []
-            cursor = conn.cursor()
-            query = """
-                select time, type
-                from mark
-                    inner join cuesheet
-                    on mark.cuesheet_id = cuesheet.id
-                where cuesheet.path = ?
-                """
-            cursor.execute(query, (path,))
-            for row in cursor.fetchall():
-                cutlist.append((row['time'], row['type']))
+        with self.connection as conn:
+            row = conn.execute("select id from cuesheet where path = ?", (path,)).fetchone()
+        if row is None and by_identity:
+            identity = get_content_identity(path)
+            if identity is not None:
+                with self.connection as conn:
+                    row = conn.execute("select id from cuesheet where identity = ? order by last_updated desc limit 1", (identity,)).fetchone()
+                if row is not None:
+                    print('[CueSheetDAO] getCutList - found by content identity')
+        if row is None:
+            return []
+        with self.connection as conn:
+            cutlist = conn.execute("select time, type from mark where cuesheet_id = ? order by time", (row[0],)).fetchall()
             if len(cutlist) > 0:
                 print('[CueSheetDAO] getCutList - succesfull')
             return cutlist
 
-    def set_cut_list(self, path, cutlist):
-        print('[CueSheetDAO] setCutList for %s' % path)
-        with sqlite3.connect(self.db_path) as conn:
+    def set_cut_list(self, path, cutlist, duration=None):
+        with self.connection.timed('set_cut_list', path):
+            return self.set_cut_lists(((path, cutlist, duration),))
+
+    def set_cut_lists(self, cutlists, identity=True, played=True):
+        """
+        Stores several (path, cutlist) or (path, cutlist, duration) tuples
+        in one transaction, returns number of touched mark rows or None on failure.
+        Without played, last_played is left as it is, e.g. for imported marks.
+        """
+        # file io is done before db gets locked
+        cutlists = [(item[0], item[1], len(item) > 2 and item[2] or None, identity and get_content_identity(item[0]) or None) for item in cutlists]
+        touched = 0
+        with self.connection as conn, self.connection.timed('set_cut_lists', len(cutlists) == 1 and cutlists[0][0] or '%d files' % len(cutlists)):
             try:
-                cursor = conn.cursor()
-                cursor.execute("insert or ignore into cuesheet (path) values (?)", (path,))
+                with conn:
+                    cursor = conn.cursor()
+                    for path, cutlist, duration, identity in cutlists:
+                        print('[CueSheetDAO] setCutList for %s' % path)
+                        touched += self._set_cut_list(cursor, path, cutlist, duration, identity, played)
+            except Exception:
+                traceback.print_exc()
+                return None
+            else:
+                print('[CueSheetDAO] setCutList was succesfull, %d rows touched' % touched)
+                return touched
+
+    def _set_cut_list(self, cursor, path, cutlist, duration=None, identity=None, played=True):
+        row = cursor.execute("select id from cuesheet where path = ?", (path,)).fetchone()
+        if row is None:
+            query = "insert into cuesheet (path, duration, identity, last_updated) values (?, ?, ?, strftime('%s', 'now'))"
+            cursor.execute(query, (path, duration, identity))
+            cuesheet_id = cursor.lastrowid
+            stored = {}
+        else:
+            cuesheet_id = row[0]
+            query = """
+                update cuesheet
+                set duration = coalesce(?, duration), identity = coalesce(?, identity), last_updated = strftime('%s', 'now')
+                where id = ?
+                """
+            cursor.execute(query, (duration, identity, cuesheet_id))
+            stored = dict(cursor.execute("select time, type from mark where cuesheet_id = ?", (cuesheet_id,)))
+        wanted = {}
+        for time, type in cutlist:
+            # first mark wins, same as UNIQUE (time, cuesheet_id) ON CONFLICT IGNORE
+            wanted.setdefault(time, type)
+        # only new last position means the file was played, not edits of other marks
+        last = set(time for time, type in wanted.items() if type == CUT_TYPE_LAST)
+        if played and last and last != set(time for time, type in stored.items() if type == CUT_TYPE_LAST):
+            cursor.execute("update cuesheet set last_played = strftime('%s', 'now') where id = ?", (cuesheet_id,))
+        removed = [(cuesheet_id, time) for time, type in stored.items() if wanted.get(time) != type]
+        added = [(time, type, cuesheet_id) for time, type in wanted.items() if stored.get(time) != type]
+        cursor.executemany("delete from mark where cuesheet_id = ? and time = ?", removed)
+        cursor.executemany("insert into mark (time, type, cuesheet_id) values (?,?,?)", added)
+        return len(removed) + len(added)
+
+    def reconcile_checkpoints(self, checkpoints):
+        """
+        Stores positions of {path: (sequence, timestamp, position, duration)}
+        checkpoints (see PositionCheckpoint.latest) as last position, unless
+        cut list of path was updated after the checkpoint was taken.
+        Returns number of restored positions.
+        """
+        cutlists = []
+        for path, (sequence, timestamp, position, duration) in checkpoints.items():
+            with self.connection as conn:
+                row = conn.execute("select last_updated from cuesheet where path = ?", (path,)).fetchone()
+            # ties go to db, it is written on regular stop
+            if row is not None and row[0] is not None and row[0] >= int(timestamp):
+                continue
+            cutlist = [mark for mark in self.get_cut_list(path, by_identity=False) if mark[1] != CUT_TYPE_LAST]
+            cutlist.append((position // 90000, CUT_TYPE_LAST))
+            cutlists.append((path, cutlist, duration and duration // 90000 or None))
+        if self.set_cut_lists(cutlists) is None:
+            return None
+        print('[CueSheetDAO] restored %d positions from checkpoints' % len(cutlists))
+        return len(cutlists)
+
+    def get_progress(self, paths=None, directory=None):
+        """
+        Returns {path: (last position, duration)} in seconds for given paths
+        or for all paths in directory (including subdirectories),
+        duration is None when unknown
+        """
+        query = """
+            select cuesheet.path, mark.time, cuesheet.duration
+            from cuesheet
+                inner join mark
+                on mark.cuesheet_id = cuesheet.id and mark.type = %d
+            where %s
+            """
+        progress = {}
+        with self.connection as conn:
+            if directory is not None:
+                low, high = self._prefix_range(directory)
+                for path, position, duration in conn.execute(query % (CUT_TYPE_LAST, "cuesheet.path >= ? and cuesheet.path < ?"), (low, high)):
+                    progress[path] = (position, duration)
+            paths = list(paths or [])
+            # stay below sqlite's host parameters limit
+            for i in range(0, len(paths), 500):
+                chunk = paths[i:i + 500]
+                where = "cuesheet.path in (%s)" % ",".join("?" * len(chunk))
+                for path, position, duration in conn.execute(query % (CUT_TYPE_LAST, where), chunk):
+                    progress[path] = (position, duration)
+        return progress
+
+    def get_recent(self, limit=20, before=None):
+        """
+        Returns list of (path, last position, duration, (last_played, id))
+        of the most recently played not finished files, ordered from
+        the newest. Pass last tuple item of previous page as before
+        to get next page.
+        """
+        query = """
+            select cuesheet.path, mark.time, cuesheet.duration, cuesheet.last_played, cuesheet.id
+            from cuesheet
+                -- cross join keeps cuesheet as outer loop, so last_played index is walked
+                cross join mark
+                on mark.cuesheet_id = cuesheet.id and mark.type = %d
+            where cuesheet.last_played is not null %s
+            order by cuesheet.last_played desc, cuesheet.id desc
+            limit ?
+            """
+        with self.connection as conn:
+            if before is None:
+                rows = conn.execute(query % (CUT_TYPE_LAST, ""), (limit,))
+            else:
+                where = "and (cuesheet.last_played < ? or (cuesheet.last_played = ? and cuesheet.id < ?))"
+                rows = conn.execute(query % (CUT_TYPE_LAST, where), (before[0], before[0], before[1], limit))
+            return [(path, position, duration, (last_played, cuesheet_id)) for path, position, duration, last_played, cuesheet_id in rows]
+
+    def import_cuts(self, root, overwrite=False):
+        """
+        Imports marks from all enigma2 .cuts files below root in one transaction,
+        files which already have saved marks are skipped unless overwrite is set.
+        Returns number of imported files.
+        """
+        low, high = self._prefix_range(root)
+        with self.connection as conn:
+            stored = set(row[0] for row in conn.execute("select path from cuesheet where path >= ? and path < ?", (low, high)))
+        cutlists = []
+        for directory, dirs, files in os.walk(root):
+            for name in files:
+                if not name.endswith('.cuts'):
+                    continue
+                path = os.path.join(directory, name[:-5])
+                if (path in stored and not overwrite) or not os.path.exists(path):
+                    continue
+                try:
+                    cutlist = read_cuts_file(path + '.cuts')
+                except (OSError, ValueError) as e:
+                    print('[CueSheetDAO] cannot read %s.cuts: %s' % (path, str(e)))
+                    continue
+                if cutlist:
+                    cutlists.append((path, [(pts // 90000, type) for pts, type in cutlist]))
+        # imported files were not played here, keep them out of "Continue watching" order
+        if self.set_cut_lists(cutlists, identity=False, played=False) is None:
+            return None
+        print('[CueSheetDAO] imported %d .cuts files from %s' % (len(cutlists), root))
+        return len(cutlists)
+
+    def export_cuts(self, root, overwrite=False):
+        """
+        Writes saved marks of all files below root to enigma2 .cuts files,
+        existing .cuts files are kept unless overwrite is set.
+        Returns number of exported files.
+        """
+        low, high = self._prefix_range(root)
+        query = """
+            select cuesheet.path, mark.time, mark.type
+            from cuesheet
+                inner join mark
+                on mark.cuesheet_id = cuesheet.id
+            where cuesheet.path >= ? and cuesheet.path < ?
+            order by cuesheet.path, mark.time
+            """
+        cutlists = OrderedDict()
+        with self.connection as conn:
+            for path, time, type in conn.execute(query, (low, high)):
+                cutlists.setdefault(path, []).append((time * 90000, type))
+        exported = 0
+        for path, cutlist in cutlists.items():
+            cuts_path = path + '.cuts'
+            if not os.path.exists(path) or (not overwrite and os.path.exists(cuts_path)):
+                continue
+            try:
+                write_cuts_file(cuts_path, cutlist)
+            except OSError as e:
+                print('[CueSheetDAO] cannot write %s: %s' % (cuts_path, str(e)))
+            else:
+                exported += 1
+        print('[CueSheetDAO] exported %d .cuts files to %s' % (exported, root))
+        return exported
+
+    def _prefix_range(self, prefix):
+        # all paths starting with prefix, as range usable with path index
+        prefix = prefix.rstrip('/') + '/'
+        return prefix, prefix[:-1] + chr(ord('/') + 1)
+
+    def get_path_prefixes(self, roots=MOUNT_ROOTS):
+        """
+        Returns list of (prefix, count) of stored paths, prefix is mount root
+        with one more directory, e.g. /media/usb/
+        """
+        prefixes = []
+        with self.connection as conn:
+            for root in roots:
+                low, high = self._prefix_range(root)
                 query = """
-                    delete from mark
-                    where cuesheet_id in
-                        (select id from cuesheet where path = ?)
+                    select substr(path, 1, ? + instr(substr(path, ? + 1), '/')) as prefix, count(*)
+                    from cuesheet
+                    where path >= ? and path < ? and instr(substr(path, ? + 1), '/') > 0
+                    group by prefix
                     """
-                cursor.execute(query, (path,))
-                cuesheet_id = cursor.execute("select id from cuesheet where path = ?", (path,)).fetchone()[0]
-                cursor.executemany("insert into mark (time, type, cuesheet_id) values (?,?,?)", ((time, type, cuesheet_id) for time, type in cutlist))
-            except Exception:
+                prefixes += conn.execute(query, (len(low), len(low), low, high, len(low))).fetchall()
+        return prefixes
+
+    def remap_prefix(self, old_prefix, new_prefix, dry_run=False):
+        """
+        Replaces old_prefix with new_prefix in all stored paths in one update,
+        paths which already exist with new prefix are left untouched.
+        Returns number of (to be) remapped paths.
+        """
+        low, high = self._prefix_range(old_prefix)
+        new_prefix = new_prefix.rstrip('/') + '/'
+        with self.connection as conn:
+            if dry_run:
+                return conn.execute("select count(*) from cuesheet where path >= ? and path < ?", (low, high)).fetchone()[0]
+            with conn:
+                query = """
+                    update or ignore cuesheet
+                    set path = ? || substr(path, ?)
+                    where path >= ? and path < ?
+                    """
+                remapped = conn.execute(query, (new_prefix, len(low) + 1, low, high)).rowcount
+        print('[CueSheetDAO] remapped %d paths from %s to %s' % (remapped, low, new_prefix))
+        return remapped
+
+    def detect_remaps(self, candidates, sample=5):
+        """
+        Finds stored prefixes which are not mounted anymore, but their files
+        (matched by content identity) exist under one of candidate prefixes.
+        Returns list of (old_prefix, new_prefix, count).
+        """
+        remaps = []
+        candidates = [candidate.rstrip('/') + '/' for candidate in candidates]
+        for prefix, count in self.get_path_prefixes():
+            if prefix in candidates or os.path.ismount(prefix.rstrip('/')):
+                continue
+            low, high = self._prefix_range(prefix)
+            with self.connection as conn:
+                query = "select path, identity from cuesheet where path >= ? and path < ? and identity is not null limit ?"
+                rows = conn.execute(query, (low, high, sample)).fetchall()
+            if not rows:
+                continue
+            for candidate in candidates:
+                if all(get_content_identity(candidate + path[len(low):]) == identity for path, identity in rows):
+                    remaps.append((prefix, candidate, count))
+                    break
+        return remaps
+
+    def get_cuesheets(self, after_id=0, limit=200):
+        with self.connection as conn:
+            return conn.execute("select id, path from cuesheet where id > ? order by id limit ?", (after_id, limit)).fetchall()
+
+    def get_expired_cuesheets(self, max_age=0, keep_count=0, limit=200):
+        """
+        Returns ids of cuesheets not updated for max_age seconds
+        or not among keep_count most recently updated ones
+        """
+        with self.connection as conn:
+            ids = []
+            if max_age > 0:
+                query = "select id from cuesheet where last_updated < strftime('%s', 'now') - ? limit ?"
+                ids += [row[0] for row in conn.execute(query, (max_age, limit))]
+            if keep_count > 0 and len(ids) < limit:
+                query = "select id from cuesheet order by last_updated desc limit ? offset ?"
+                ids += [row[0] for row in conn.execute(query, (limit - len(ids), keep_count))]
+            return list(set(ids))
+
+    def delete_cuesheets(self, ids):
+        """
+        Deletes cuesheets with their marks, returns number of removed rows
+        """
+        if not ids:
+            return 0
+        with self.connection as conn:
+            with conn:
+                params = [(cuesheet_id,) for cuesheet_id in ids]
+                removed = conn.executemany("delete from mark where cuesheet_id = ?", params).rowcount
+                removed += conn.executemany("delete from cuesheet where id = ?", params).rowcount
+                return removed
+
+    def get_db_size(self):
+        with self.connection as conn:
+            page_count = conn.execute("pragma page_count").fetchone()[0]
+            page_size = conn.execute("pragma page_size").fetchone()[0]
+            return page_count * page_size
+
+    def incremental_vacuum(self, pages):
+        """
+        Returns number of free pages left in db, dbs created without
+        incremental auto vacuum are left as they are and 0 is returned
+        """
+        with self.connection as conn:
+            if conn.execute("pragma auto_vacuum").fetchone()[0] != 2:
+                print('[CueSheetDAO] db is not in incremental auto vacuum mode, %d free pages not reclaimed' %
+                      conn.execute("pragma freelist_count").fetchone()[0])
+                return 0
+            conn.execute("pragma incremental_vacuum(%d)" % pages).fetchall()
+            return conn.execute("pragma freelist_count").fetchone()[0]
+
+
+class AsyncCueSheetDAO(object):
+    """
+    Runs CueSheetDAO methods in a worker thread.
+
+    Results are handed to callFromThread(callback, result), which has to run
+    callback on the main loop (reactor.callFromThread in enigma2). Requests
+    are processed one by one in FIFO order, so requests for the same path
+    complete in the order they were issued. If callFromThread is None,
+    methods are called synchronously.
+    """
+
+    def __init__(self, dao, callFromThread=None):
+        self.dao = dao
+        self.callFromThread = callFromThread
+        self.queue = queue.Queue()
+        self.thread = None
+        self.threadLock = threading.Lock()
+
+    def call(self, method, args=(), callback=None, errback=None):
+        if self.callFromThread is None:
+            try:
+                result = getattr(self.dao, method)(*args)
+            except Exception as e:
                 traceback.print_exc()
-                conn.rollback()
+                if errback is not None:
+                    errback(e)
             else:
-                print('[CueSheetDAO] setCutList for %s was succesfull' % path)
-                conn.commit()
+                if callback is not None:
+                    callback(result)
+            return
+        self.__startThread()
+        self.queue.put((method, args, callback, errback))
+
+    def get_cut_list(self, path, callback, errback=None, by_identity=True):
+        self.call('get_cut_list', (path, by_identity), callback, errback)
+
+    def set_cut_lists(self, cutlists, callback=None, errback=None):
+        self.call('set_cut_lists', (cutlists,), callback, errback)
+
+    def close(self, timeout=5):
+        """
+        Waits (at most timeout seconds) until queued requests are processed
+        """
+        with self.threadLock:
+            thread, self.thread = self.thread, None
+        if thread is not None:
+            self.queue.put(None)
+            thread.join(timeout)
+
+    def __startThread(self):
+        with self.threadLock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, args=(self.queue,), name='AsyncCueSheetDAO')
+                self.thread.daemon = True
+                self.thread.start()
+
+    def __run(self, requests):
+        while True:
+            request = requests.get()
+            if request is None:
+                break
+            method, args, callback, errback = request
+            try:
+                result = getattr(self.dao, method)(*args)
+            except Exception as e:
+                traceback.print_exc()
+                if errback is not None:
+                    self.callFromThread(errback, e)
+            else:
+                if callback is not None:
+                    self.callFromThread(callback, result)
+
+
+class CueSheetMaintenance(object):
+    """
+    Removes cuesheets of deleted files, applies retention policy and
+    gives free pages back to filesystem.
+
+    Works in chunks, so the shared connection is never locked for long,
+    run() is meant to be called from a worker thread.
+    """
+    CHUNK_SIZE = 200
+    VACUUM_PAGES = 128
+    MOUNT_ROOTS = MOUNT_ROOTS
+
+    def __init__(self, dao, retentionDays=0, retentionCount=0, chunkSize=CHUNK_SIZE):
+        self.dao = dao
+        self.retentionDays = retentionDays
+        self.retentionCount = retentionCount
+        self.chunkSize = chunkSize
+        self.cancelled = False
+        self.stats = {'checked': 0, 'pruned': 0, 'expired': 0, 'skipped': 0, 'rows_removed': 0, 'bytes_reclaimed': 0}
+        self.__mounted = {}
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        stats = self.stats
+        size = self.dao.get_db_size()
+        last_id = 0
+        while not self.cancelled:
+            chunk = self.dao.get_cuesheets(last_id, self.chunkSize)
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            missing = []
+            for cuesheet_id, path in chunk:
+                stats['checked'] += 1
+                if self.isMissing(path):
+                    missing.append(cuesheet_id)
+            stats['pruned'] += len(missing)
+            stats['rows_removed'] += self.dao.delete_cuesheets(missing)
+        while not self.cancelled and (self.retentionDays > 0 or self.retentionCount > 0):
+            expired = self.dao.get_expired_cuesheets(self.retentionDays * 24 * 3600, self.retentionCount, self.chunkSize)
+            if not expired:
+                break
+            stats['expired'] += len(expired)
+            stats['rows_removed'] += self.dao.delete_cuesheets(expired)
+        while not self.cancelled and self.dao.incremental_vacuum(self.VACUUM_PAGES) > 0:
+            pass
+        stats['bytes_reclaimed'] = max(0, size - self.dao.get_db_size())
+        print('[CueSheetMaintenance] finished', stats)
+        return stats
+
+    def isMissing(self, path):
+        if not path.startswith('/'):
+            # stream
+            return False
+        if os.path.exists(path):
+            return False
+        if not self.isDeviceMounted(path):
+            self.stats['skipped'] += 1
+            return False
+        return True
+
+    def isDeviceMounted(self, path):
+        directory = os.path.dirname(path)
+        mounted = self.__mounted.get(directory)
+        if mounted is None:
+            existing = directory
+            while not os.path.isdir(existing):
+                existing = os.path.dirname(existing)
+            mountpoint = existing
+            while not os.path.ismount(mountpoint):
+                mountpoint = os.path.dirname(mountpoint)
+            # nearest existing directory is on root fs, so device is most likely gone
+            mounted = not (mountpoint == '/' and path.startswith(self.MOUNT_ROOTS))
+            self.__mounted[directory] = mounted
+        return mounted
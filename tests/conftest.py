@@ -0,0 +1,12 @@
+import os
+import sys
+
+import e2stubs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# util.py and other enigma2 independent modules are imported directly
+# from the plugin directory, the package itself is imported with enigma2 stubs
+sys.path.insert(0, os.path.join(ROOT, 'plugin'))
+sys.path.insert(0, ROOT)
+e2stubs.install()
@@ -0,0 +1,168 @@
+"""
+Minimal stand-ins for enigma2 modules, so plugin modules which need them
+at import time can be tested. Unknown names resolve to permissive stubs,
+the few pieces tests interact with (timers, service events, config) are
+simple fakes which can be driven from tests.
+"""
+import builtins
+import functools
+import importlib.abc
+import importlib.machinery
+import sys
+import types
+
+STUB_PACKAGES = ('enigma', 'skin', 'Components', 'Screens', 'Tools', 'twisted')
+
+
+class StubMeta(type):
+    def __getattr__(cls, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = Stub()
+        setattr(cls, name, value)
+        return value
+
+
+class Stub(object, metaclass=StubMeta):
+    """
+    Accepts any arguments, attribute access and call
+    """
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = Stub()
+        object.__setattr__(self, name, value)
+        return value
+
+    def __call__(self, *args, **kwargs):
+        return Stub()
+
+    def __getitem__(self, key):
+        return Stub()
+
+    def __setitem__(self, key, value):
+        pass
+
+    def __iter__(self):
+        return iter(())
+
+    def __fspath__(self):
+        return '/nonexistent'
+
+
+class StubModule(types.ModuleType):
+    __path__ = []
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        # classes are subclassed by plugin code, other names are used as objects
+        value = type(name, (Stub,), {}) if name[:1].isupper() else Stub()
+        setattr(self, name, value)
+        return value
+
+
+class eTimer(object):
+    instances = []
+
+    def __init__(self):
+        self.callback = []
+        self.active = False
+        self.delay = None
+        eTimer.instances.append(self)
+
+    def start(self, delay, singleShot=False):
+        self.active = True
+        self.delay = delay
+
+    def stop(self):
+        self.active = False
+
+    def isActive(self):
+        return self.active
+
+    def fire(self):
+        self.active = False
+        for f in list(self.callback):
+            f()
+
+
+class iPlayableService(object):
+    evStart, evEnd, evTunedIn, evTuneFailed, evUpdatedEventInfo, evUpdatedInfo, evNewProgramInfo, \
+        evSeekableStatusChanged, evEOF, evSOF, evCuesheetChanged, evUpdatedRadioText, evUpdatedRassSlidePic, \
+        evUpdatedRassInteractivePicMask, evVideoSizeChanged, evVideoFramerateChanged, evVideoProgressiveChanged, \
+        evBuffering, evStopped, evHBBTVInfo, evFccFailed, evUser = range(22)
+
+
+class ServiceEventTracker(object):
+    """
+    Keeps event maps of all trackers, fire() calls handlers of one screen
+    """
+    trackers = []
+
+    def __init__(self, screen, eventmap):
+        ServiceEventTracker.trackers.append((screen, eventmap))
+
+    @classmethod
+    def fire(cls, screen, event):
+        for owner, eventmap in cls.trackers:
+            if owner is screen and event in eventmap:
+                eventmap[event]()
+
+
+class ConfigSubsection(object):
+    pass
+
+
+class ConfigElement(object):
+    def __init__(self, default=None, *args, **kwargs):
+        self.value = default
+
+
+def boundFunction(f, *args, **kwargs):
+    return functools.partial(f, *args, **kwargs)
+
+
+def moduleAttributes(name):
+    if name == 'enigma':
+        return {'eTimer': eTimer, 'iPlayableService': iPlayableService}
+    if name == 'Components.ServiceEventTracker':
+        return {'ServiceEventTracker': ServiceEventTracker}
+    if name == 'Tools.BoundFunction':
+        return {'boundFunction': boundFunction}
+    if name == 'Components.config':
+        config = ConfigSubsection()
+        config.plugins = ConfigSubsection()
+        attributes = {'config': config, 'ConfigSubsection': ConfigSubsection}
+        for element in ('ConfigYesNo', 'ConfigOnOff', 'ConfigDirectory', 'ConfigSelection', 'ConfigInteger', 'ConfigNothing'):
+            attributes[element] = ConfigElement
+        return attributes
+    return {}
+
+
+class StubFinder(importlib.abc.MetaPathFinder, importlib.abc.Loader):
+    def find_spec(self, fullname, path, target=None):
+        if fullname.split('.')[0] in STUB_PACKAGES:
+            return importlib.machinery.ModuleSpec(fullname, self, is_package=True)
+        return None
+
+    def create_module(self, spec):
+        return StubModule(spec.name)
+
+    def exec_module(self, module):
+        for name, value in moduleAttributes(module.__name__).items():
+            setattr(module, name, value)
+
+
+def install():
+    try:
+        import enigma
+    except ImportError:
+        sys.meta_path.insert(0, StubFinder())
+        # enigma2 installs gettext into builtins
+        if not hasattr(builtins, '_'):
+            builtins._ = lambda text: text
@@ -0,0 +1,134 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from util import AsyncCueSheetDAO, CueSheetDAO
+
+
+class MainLoop(object):
+    """
+    Stand-in for the enigma2 main loop, callFromThread queues calls
+    which are run by the test thread in run()
+    """
+
+    def __init__(self):
+        self.calls = queue.Queue()
+        self.thread = threading.current_thread()
+
+    def callFromThread(self, f, *args):
+        self.calls.put((f, args))
+
+    def run(self, count, timeout=5):
+        deadline = time.monotonic() + timeout
+        for i in range(count):
+            f, args = self.calls.get(timeout=max(0, deadline - time.monotonic()))
+            f(*args)
+
+
+class SlowDAO(object):
+    def __init__(self):
+        self.stored = {}
+        self.threads = set()
+        self.by_identity = []
+
+    def get_cut_list(self, path, by_identity=True):
+        self.threads.add(threading.current_thread())
+        self.by_identity.append(by_identity)
+        time.sleep(0.001)
+        return list(self.stored.get(path, []))
+
+    def set_cut_lists(self, cutlists):
+        self.threads.add(threading.current_thread())
+        time.sleep(0.002)
+        for path, cutlist in cutlists:
+            self.stored[path] = list(cutlist)
+        return len(cutlists)
+
+    def fail(self, message):
+        raise ValueError(message)
+
+
+@pytest.fixture
+def loop():
+    return MainLoop()
+
+
+def test_results_are_delivered_on_main_loop_in_fifo_order(loop):
+    dao = SlowDAO()
+    async_dao = AsyncCueSheetDAO(dao, loop.callFromThread)
+    results = []
+    for i in range(20):
+        path = '/media/hdd/%d.mkv' % (i % 3)
+        async_dao.set_cut_lists([(path, [(i, 3)])], lambda result, i=i: results.append(('set', i)))
+        async_dao.get_cut_list(path, lambda cutlist, i=i: results.append(('get', i, cutlist)))
+    loop.run(40)
+    async_dao.close()
+    assert results == [item for i in range(20) for item in (('set', i), ('get', i, [(i, 3)]))]
+    assert loop.thread not in dao.threads
+
+
+def test_read_issued_after_write_sees_written_marks(loop):
+    async_dao = AsyncCueSheetDAO(SlowDAO(), loop.callFromThread)
+    path = '/media/hdd/movie.mkv'
+    seen = []
+    for position in (10, 20, 30):
+        async_dao.set_cut_lists([(path, [(position, 3)])])
+        async_dao.get_cut_list(path, seen.append)
+    loop.run(3)
+    async_dao.close()
+    assert seen == [[(10, 3)], [(20, 3)], [(30, 3)]]
+
+
+def test_errback_is_called_on_main_loop_in_fifo_order(loop):
+    async_dao = AsyncCueSheetDAO(SlowDAO(), loop.callFromThread)
+    results = []
+    async_dao.call('fail', ('broken',), results.append, lambda e: results.append(('error', str(e))))
+    async_dao.get_cut_list('/media/hdd/a.mkv', results.append)
+    loop.run(2)
+    async_dao.close()
+    assert results == [('error', 'broken'), []]
+
+
+def test_error_without_errback_does_not_stop_worker(loop):
+    async_dao = AsyncCueSheetDAO(SlowDAO(), loop.callFromThread)
+    results = []
+    async_dao.call('fail', ('broken',))
+    async_dao.get_cut_list('/media/hdd/a.mkv', results.append)
+    loop.run(1)
+    async_dao.close()
+    assert results == [[]]
+
+
+def test_sync_fallback_runs_in_caller_thread():
+    dao = SlowDAO()
+    async_dao = AsyncCueSheetDAO(dao)
+    results, errors = [], []
+    async_dao.set_cut_lists([('/media/hdd/a.mkv', [(5, 3)])], results.append)
+    async_dao.get_cut_list('/media/hdd/a.mkv', results.append)
+    async_dao.call('fail', ('broken',), results.append, errors.append)
+    assert results == [1, [(5, 3)]]
+    assert [str(e) for e in errors] == ['broken']
+    assert dao.threads == {threading.current_thread()}
+    assert async_dao.thread is None
+
+
+def test_identity_lookup_can_be_skipped(loop):
+    dao = SlowDAO()
+    async_dao = AsyncCueSheetDAO(dao, loop.callFromThread)
+    async_dao.get_cut_list('/media/hdd/a.mkv', lambda cutlist: None)
+    async_dao.get_cut_list('/media/hdd/a.mkv', lambda cutlist: None, by_identity=False)
+    loop.run(2)
+    async_dao.close()
+    assert dao.by_identity == [True, False]
+
+
+def test_close_waits_for_queued_writes(loop, tmp_path):
+    dao = CueSheetDAO(str(tmp_path / 'cuesheet.db'))
+    async_dao = AsyncCueSheetDAO(dao, loop.callFromThread)
+    paths = ['/media/hdd/%d.mkv' % i for i in range(10)]
+    for i, path in enumerate(paths):
+        async_dao.set_cut_lists([(path, [(i, 0), (i + 60, 3)])])
+    async_dao.close()
+    assert [dao.get_cut_list(path, by_identity=False) for path in paths] == [[(i, 0), (i + 60, 3)] for i in range(10)]
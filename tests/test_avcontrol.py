@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from avcontrol import AVControl
+
+
+@pytest.fixture
+def root(tmp_path):
+    # stands in for /proc/stb/video
+    for name, value in (('aspect', '16:9'), ('policy', 'letterbox'), ('policy2', 'letterbox')):
+        (tmp_path / name).write_text(value + '\n')
+    return tmp_path
+
+
+def read(root, name):
+    return (root / name).read_text()
+
+
+def writes(monkeypatch):
+    written = []
+    real_open = open
+
+    def recording_open(path, mode='r', *args, **kwargs):
+        if 'w' in mode:
+            written.append(os.path.basename(path))
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', recording_open)
+    return written
+
+
+def test_only_changed_values_are_written(root, monkeypatch):
+    control = AVControl(str(root))
+    written = writes(monkeypatch)
+    assert control.set((('aspect', '16:9'), ('policy', 'panscan'), ('policy2', None))) == ['policy']
+    assert written == ['policy']
+    assert read(root, 'policy') == 'panscan'
+    assert read(root, 'aspect') == '16:9\n'
+
+
+def test_repeated_mode_writes_nothing(root, monkeypatch):
+    control = AVControl(str(root))
+    mode = (('aspect', '4:3'), ('policy', 'panscan'), ('policy2', 'panscan'))
+    assert control.set(mode) == ['aspect', 'policy', 'policy2']
+    written = writes(monkeypatch)
+    assert control.set(mode) == []
+    assert written == []
+
+
+def test_restore_writes_original_values(root):
+    control = AVControl(str(root))
+    control.set((('aspect', '4:3'), ('policy', 'panscan')))
+    control.set((('aspect', '16:10'),))
+    assert control.restore() == ['aspect', 'policy']
+    assert read(root, 'aspect') == '16:9'
+    assert read(root, 'policy') == 'letterbox'
+    assert control.restore() == []
+
+
+def test_write_failure_drops_cached_state(root, monkeypatch):
+    control = AVControl(str(root))
+    real_open = open
+
+    def failing_open(path, mode='r', *args, **kwargs):
+        if 'w' in mode:
+            raise OSError('Device or resource busy')
+        return real_open(path, mode, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', failing_open)
+    assert control.set((('aspect', '4:3'),)) == []
+    assert 'aspect' not in control.state
+    monkeypatch.setattr('builtins.open', real_open)
+    # state is read again, so the same value is retried
+    assert control.set((('aspect', '4:3'),)) == ['aspect']
+    assert read(root, 'aspect') == '4:3'
@@ -0,0 +1,40 @@
+from util import CUT_TYPE_LAST, CueSheetDAO, write_cuts_file
+
+
+def set_last_played(dao, path, last_played):
+    with dao.connection as conn, conn:
+        conn.execute("update cuesheet set last_played = ? where path = ?", (last_played, path))
+
+
+def recent_paths(dao):
+    return [item[0] for item in dao.get_recent()]
+
+
+def test_last_played_follows_last_position_only(tmp_path):
+    dao = CueSheetDAO(str(tmp_path / 'cuesheet.db'))
+    dao.set_cut_list('/media/hdd/a.mkv', [(100, CUT_TYPE_LAST)])
+    dao.set_cut_list('/media/hdd/b.mkv', [(200, CUT_TYPE_LAST)])
+    set_last_played(dao, '/media/hdd/a.mkv', 2)
+    set_last_played(dao, '/media/hdd/b.mkv', 1)
+    assert recent_paths(dao) == ['/media/hdd/a.mkv', '/media/hdd/b.mkv']
+    # toggling an ordinary mark keeps the order
+    dao.set_cut_list('/media/hdd/b.mkv', [(50, 2), (200, CUT_TYPE_LAST)])
+    assert recent_paths(dao) == ['/media/hdd/a.mkv', '/media/hdd/b.mkv']
+    # new last position moves the file to the top
+    dao.set_cut_list('/media/hdd/b.mkv', [(50, 2), (300, CUT_TYPE_LAST)])
+    assert recent_paths(dao) == ['/media/hdd/b.mkv', '/media/hdd/a.mkv']
+
+
+def test_import_cuts_keeps_continue_watching(tmp_path):
+    dao = CueSheetDAO(str(tmp_path / 'cuesheet.db'))
+    media = tmp_path / 'media'
+    media.mkdir()
+    played = str(media / 'played.mkv')
+    dao.set_cut_list(played, [(100, CUT_TYPE_LAST)])
+    for name in ('a.mkv', 'b.mkv', 'c.mkv'):
+        path = str(media / name)
+        open(path, 'w').close()
+        write_cuts_file(path + '.cuts', [(10 * 90000, 2), (60 * 90000, CUT_TYPE_LAST)])
+    assert dao.import_cuts(str(media)) == 3
+    assert recent_paths(dao) == [played]
+    assert dao.get_cut_list(str(media / 'a.mkv'), by_identity=False) == [(10, 2), (60, CUT_TYPE_LAST)]
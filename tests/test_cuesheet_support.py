@@ -0,0 +1,278 @@
+import pytest
+
+from e2stubs import ServiceEventTracker, eTimer, iPlayableService
+from plugin import e2util
+from plugin.settings import SERVICEMP3
+
+LAST = e2util.InfoBarCueSheetSupport.CUT_TYPE_LAST
+MARK = e2util.InfoBarCueSheetSupport.CUT_TYPE_MARK
+MINUTE = 60 * 90000
+
+
+class FakeCutList(object):
+    """
+    Stands in for e2util.CutList, records uploads
+    """
+
+    def __init__(self, filename, cacheSize=0):
+        self.stored = {}
+        self.uploads = []
+
+    def getCutListAsync(self, path, callback):
+        callback(list(self.stored.get(path, [])))
+
+    def setCutList(self, path, cutList, duration=None):
+        self.uploads.append((path, list(cutList)))
+        self.stored[path] = list(cutList)
+
+    def prefetch(self, paths):
+        pass
+
+    def checkpoint(self, path, position, duration=None):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FakeRef(object):
+    type = SERVICEMP3
+
+    def __init__(self, path):
+        self.path = path
+
+    def getPath(self):
+        return self.path
+
+
+class FakeSeek(object):
+    def __init__(self):
+        self.length = 0
+        self.position = 0
+        self.seekable = False
+
+    def getLength(self):
+        return (0, self.length)
+
+    def getPlayPosition(self):
+        return (0, self.position)
+
+    def isCurrentlySeekable(self):
+        return self.seekable
+
+
+class FakeService(object):
+    def __init__(self):
+        self.seekable = FakeSeek()
+
+    def seek(self):
+        return self.seekable
+
+
+class FakeNav(object):
+    def __init__(self):
+        self.ref = None
+        self.service = None
+
+    def getCurrentlyPlayingServiceReference(self):
+        return self.ref
+
+    def getCurrentService(self):
+        return self.service
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.nav = FakeNav()
+
+
+class Player(e2util.MyInfoBarCueSheetSupport):
+    def __init__(self):
+        self.session = FakeSession()
+        self.renderer = []
+        self.onClose = []
+        self.seeks = []
+        e2util.MyInfoBarCueSheetSupport.__init__(self)
+
+    def __setitem__(self, key, value):
+        pass
+
+    def doSeek(self, pts):
+        self.seeks.append(pts)
+
+    def play(self, path, length=0, position=0):
+        self.session.nav.ref = FakeRef(path)
+        self.session.nav.service = FakeService()
+        self.seek.length = length
+        self.seek.position = position
+        ServiceEventTracker.fire(self, iPlayableService.evStart)
+
+    def stop(self):
+        ServiceEventTracker.fire(self, iPlayableService.evEnd)
+        self.session.nav.ref = None
+        self.session.nav.service = None
+
+    @property
+    def seek(self):
+        return self.session.nav.service.seekable
+
+
+@pytest.fixture
+def player(monkeypatch):
+    monkeypatch.setattr(e2util, 'CutList', FakeCutList)
+    monkeypatch.setattr(ServiceEventTracker, 'trackers', [])
+    monkeypatch.setattr(eTimer, 'instances', [])
+    return Player()
+
+
+@pytest.fixture
+def cutList(player):
+    return player._MyInfoBarCueSheetSupport__cutList
+
+
+def test_save_last_position_uploads_once(player, cutList):
+    path = '/media/hdd/a.mkv'
+    cutList.stored[path] = [(MINUTE, MARK), (2 * MINUTE, LAST), (3 * MINUTE, LAST)]
+    player.play(path, length=100 * MINUTE, position=10 * MINUTE)
+    assert player.cut_list == cutList.stored[path]
+    # stop/start cycle: stale LAST marks are replaced by one, with one upload
+    player.saveLastPosition()
+    assert cutList.uploads == [(path, [(MINUTE, MARK), (10 * MINUTE, LAST)])]
+    # same position again, nothing to upload
+    player.saveLastPosition()
+    assert len(cutList.uploads) == 1
+
+
+def test_remove_last_position_uploads_once(player, cutList):
+    path = '/media/hdd/a.mkv'
+    player.play(path, length=100 * MINUTE, position=99 * MINUTE)
+    player.cut_list = [(MINUTE, MARK), (50 * MINUTE, LAST)]
+    # within end limit, LAST mark is removed
+    player.saveLastPosition()
+    assert cutList.uploads == [(path, [(MINUTE, MARK)])]
+    player.saveLastPosition()
+    player.removeLastPosition()
+    assert len(cutList.uploads) == 1
+
+
+def test_no_upload_without_last_position(player, cutList):
+    player.play('/media/hdd/a.mkv', length=100 * MINUTE, position=99 * MINUTE)
+    player.cut_list = [(MINUTE, MARK)]
+    player.removeLastPosition()
+    player.saveLastPosition()
+    assert cutList.uploads == []
+
+
+class Notifications(object):
+    def __init__(self):
+        self.shown = []
+
+    def AddNotificationWithCallback(self, callback, screen, text, **kwargs):
+        self.shown.append(text)
+
+
+@pytest.fixture
+def notifications(monkeypatch, player):
+    notifications = Notifications()
+    monkeypatch.setattr(e2util, 'Notifications', notifications)
+    monkeypatch.setattr(player, 'ENABLE_RESUME_SUPPORT', True, raising=False)
+    monkeypatch.setattr(e2util.config.plugins.mediaplayer2.onMovieStart, 'value', 'resume')
+    return notifications
+
+
+def test_previous_marks_are_not_saved_under_next_service(player, cutList):
+    cutList.stored['/media/hdd/a.mkv'] = [(MINUTE, MARK), (5 * MINUTE, LAST)]
+    cutList.stored['/media/hdd/b.mkv'] = [(7 * MINUTE, MARK)]
+    player.play('/media/hdd/a.mkv', length=100 * MINUTE)
+    assert player.cut_list == cutList.stored['/media/hdd/a.mkv']
+    player.stop()
+    # service reference of next service is not known at evStart yet
+    player.session.nav.service = FakeService()
+    ServiceEventTracker.fire(player, iPlayableService.evStart)
+    player.session.nav.ref = FakeRef('/media/hdd/b.mkv')
+    assert player.cut_list == []
+    player.seek.position = 10 * MINUTE
+    player.seek.length = 100 * MINUTE
+    player.saveLastPosition()
+    player.toggleMark()
+    assert cutList.uploads == []
+    assert cutList.stored['/media/hdd/b.mkv'] == [(7 * MINUTE, MARK)]
+
+
+def test_cut_list_is_loaded_before_length_is_known(player, cutList, notifications):
+    path = '/media/hdd/a.mkv'
+    cutList.stored[path] = [(MINUTE, MARK), (20 * MINUTE, LAST)]
+    player.play(path, length=0)
+    # marks are there right away, resume waits for length
+    assert player.cut_list == cutList.stored[path]
+    assert player.cutListLoaded
+    assert notifications.shown == []
+    ServiceEventTracker.fire(player, iPlayableService.evUpdatedInfo)
+    assert notifications.shown == []
+    player.seek.length = 100 * MINUTE
+    ServiceEventTracker.fire(player, iPlayableService.evSeekableStatusChanged)
+    assert notifications.shown == ['Resuming playback']
+    ServiceEventTracker.fire(player, iPlayableService.evUpdatedInfo)
+    assert notifications.shown == ['Resuming playback']
+
+
+def test_resume_is_asked_when_length_never_comes(player, cutList, notifications):
+    path = 'http://example.com/stream'
+    cutList.stored[path] = [(20 * MINUTE, LAST)]
+    player.play(path, length=0)
+    assert player.cut_list == cutList.stored[path]
+    assert player.timer.isActive()
+    player.timer.fire()
+    assert notifications.shown == []
+    player._InfoBarCueSheetSupport__startedAt -= player.SERVICE_READY_TIMEOUT / 1000.0
+    player.timer.fire()
+    assert len(notifications.shown) == 1
+    assert notifications.shown[0].startswith('Do you want to resume this playback?')
+    assert not player.timer.isActive()
+
+
+def test_no_wait_for_length_without_resume_point(player, cutList, notifications):
+    player.play('/media/hdd/a.mkv', length=0)
+    assert player.cutListLoaded
+    assert not player.timer.isActive()
+
+
+def test_resume_seek_is_issued_once_when_seekable(player, cutList, notifications):
+    path = '/media/hdd/a.mkv'
+    cutList.stored[path] = [(20 * MINUTE, LAST)]
+    player.play(path, length=100 * MINUTE)
+    # decided right away, service is not seekable yet
+    assert notifications.shown == ['Resuming playback']
+    assert player.seeks == []
+    for i in range(3):
+        ServiceEventTracker.fire(player, iPlayableService.evSeekableStatusChanged)
+    assert player.seeks == []
+    player.seek.seekable = True
+    for i in range(3):
+        ServiceEventTracker.fire(player, iPlayableService.evSeekableStatusChanged)
+    assert player.seeks == [20 * MINUTE]
+    # hiding resume message does not seek again
+    player.resumedCB(True)
+    assert player.seeks == [20 * MINUTE]
+
+
+def test_pending_seek_is_dropped_on_service_end(player, cutList, notifications):
+    path = '/media/hdd/a.mkv'
+    cutList.stored[path] = [(20 * MINUTE, LAST)]
+    player.play(path, length=100 * MINUTE)
+    player.stop()
+    player.play('/media/hdd/b.mkv', length=100 * MINUTE)
+    player.seek.seekable = True
+    ServiceEventTracker.fire(player, iPlayableService.evSeekableStatusChanged)
+    assert player.seeks == []
+
+
+def test_seek_when_ready_seeks_immediately_when_seekable(player):
+    player.play('/media/hdd/a.mkv', length=100 * MINUTE)
+    player.seek.seekable = True
+    player.seekWhenReady(MINUTE)
+    ServiceEventTracker.fire(player, iPlayableService.evSeekableStatusChanged)
+    assert player.seeks == [MINUTE]
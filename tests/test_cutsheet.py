@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from cutsheet import CUT_TYPE_IN, CUT_TYPE_LAST, CUT_TYPE_MARK, CUT_TYPE_OUT, CutPointDistance, CutSheet
+
+
+def linear_nearest(cut_list, pts, cmp=abs, start=False):
+    # InfoBarCueSheetSupport.getNearestCutPoint before the bisect index
+    beforecut = True
+    nearest = None
+    bestdiff = -1
+    instate = True
+    if start:
+        bestdiff = cmp(0 - pts)
+        if bestdiff >= 0:
+            nearest = [0, False]
+    for cp in cut_list:
+        if beforecut and cp[1] in (CUT_TYPE_IN, CUT_TYPE_OUT):
+            beforecut = False
+            if cp[1] == CUT_TYPE_IN:  # Start is here, disregard previous marks
+                diff = cmp(cp[0] - pts)
+                if start and diff >= 0:
+                    nearest = cp
+                    bestdiff = diff
+                else:
+                    nearest = None
+                    bestdiff = -1
+        if cp[1] == CUT_TYPE_IN:
+            instate = True
+        elif cp[1] == CUT_TYPE_OUT:
+            instate = False
+        elif cp[1] in (CUT_TYPE_MARK, CUT_TYPE_LAST):
+            diff = cmp(cp[0] - pts)
+            if instate and diff >= 0 and (nearest is None or bestdiff > diff):
+                nearest = cp
+                bestdiff = diff
+    return nearest
+
+
+def random_cut_list(rnd):
+    # small value range, so equal times and equal distances are common
+    span = rnd.choice((10, 100, 10000))
+    return sorted((rnd.randint(0, span), rnd.choice((CUT_TYPE_IN, CUT_TYPE_OUT, CUT_TYPE_MARK, CUT_TYPE_MARK, CUT_TYPE_LAST))) for i in range(rnd.randint(0, 12)))
+
+
+DISTANCES = [
+    (CutPointDistance(), abs),
+    (CutPointDistance(1), lambda x: x),
+    (CutPointDistance(1, 3), lambda x: x - 3),
+    (CutPointDistance(-1), lambda x: -x),
+    (CutPointDistance(-1, 5), lambda x: -x - 5),
+]
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_nearest_matches_linear_scan(seed):
+    rnd = random.Random(seed)
+    for i in range(2000):
+        cut_list = random_cut_list(rnd)
+        sheet = CutSheet(cut_list)
+        span = cut_list and cut_list[-1][0] + 5 or 10
+        for distance, cmp in DISTANCES:
+            pts = rnd.randint(-5, span)
+            start = rnd.random() < 0.5
+            expected = linear_nearest(cut_list, pts, cmp, start)
+            nearest = sheet.nearest(pts, distance, start)
+            assert nearest == expected, (cut_list, pts, distance.direction, distance.offset, start)
+
+
+def test_end_cut():
+    assert CutSheet([(10, CUT_TYPE_IN), (50, CUT_TYPE_OUT), (80, CUT_TYPE_OUT)]).endCut == 50
+    assert CutSheet([(10, CUT_TYPE_IN), (20, CUT_TYPE_LAST)]).endCut is False
+    assert CutSheet([(10, CUT_TYPE_OUT), (20, CUT_TYPE_MARK)]).marks == []
+
+
+def test_distance():
+    assert [CutPointDistance()(x) for x in (-7, 0, 7)] == [7, 0, 7]
+    assert CutPointDistance(1, 90000)(100000) == 10000
+    assert CutPointDistance(-1, 5)(-20) == 15
@@ -0,0 +1,107 @@
+import os
+import signal
+import subprocess
+import sys
+import textwrap
+
+from util import CUT_TYPE_LAST, CueSheetDAO, PositionCheckpoint
+
+PLUGIN_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'plugin')
+
+
+def kill_after_checkpoints(path, checkpoints):
+    """
+    Writes checkpoints in a child process, which is then killed
+    without closing (or syncing) the checkpoint file
+    """
+    script = textwrap.dedent("""
+        import os, signal, sys
+        sys.path.insert(0, %r)
+        from util import PositionCheckpoint
+        checkpoint = PositionCheckpoint(%r, syncEvery=0)
+        for path, position, duration in %r:
+            checkpoint.write(path, position, duration)
+        os.kill(os.getpid(), signal.SIGKILL)
+        """) % (PLUGIN_DIR, path, checkpoints)
+    process = subprocess.run([sys.executable, '-c', script])
+    assert process.returncode == -signal.SIGKILL
+
+
+def set_last_updated(dao, path, last_updated):
+    with dao.connection as conn, conn:
+        conn.execute("update cuesheet set last_updated = ? where path = ?", (last_updated, path))
+
+
+def test_checkpoints_survive_kill(tmp_path):
+    path = str(tmp_path / 'positions.checkpoint')
+    kill_after_checkpoints(path, [
+        ('/media/hdd/a.mkv', 10 * 90000, 3600 * 90000),
+        ('/media/hdd/b.mkv', 20 * 90000, None),
+        ('/media/hdd/a.mkv', 30 * 90000, 3600 * 90000),
+    ])
+    checkpoint = PositionCheckpoint(path)
+    latest = checkpoint.latest()
+    checkpoint.close()
+    assert sorted((path, item[0], item[2], item[3]) for path, item in latest.items()) == [
+        ('/media/hdd/a.mkv', 3, 30 * 90000, 3600 * 90000),
+        ('/media/hdd/b.mkv', 2, 20 * 90000, None),
+    ]
+
+
+def test_ring_keeps_newest_and_continues_sequence(tmp_path):
+    path = str(tmp_path / 'positions.checkpoint')
+    checkpoint = PositionCheckpoint(path)
+    for i in range(PositionCheckpoint.SLOTS + 5):
+        checkpoint.write('/media/hdd/%d.mkv' % i, i * 90000)
+    checkpoint.close()
+    checkpoint = PositionCheckpoint(path)
+    checkpoints = checkpoint.read()
+    assert [item[0] for item in checkpoints] == list(range(6, PositionCheckpoint.SLOTS + 6))
+    checkpoint.write('/media/hdd/next.mkv', 0)
+    assert checkpoint.read()[-1][0] == PositionCheckpoint.SLOTS + 6
+    checkpoint.close()
+
+
+def test_torn_slot_is_ignored(tmp_path):
+    path = str(tmp_path / 'positions.checkpoint')
+    checkpoint = PositionCheckpoint(path)
+    checkpoint.write('/media/hdd/a.mkv', 10 * 90000)
+    checkpoint.write('/media/hdd/a.mkv', 20 * 90000)
+    # second write was interrupted after the header
+    offset = 2 * PositionCheckpoint.SLOT_SIZE + PositionCheckpoint.CRC.size + PositionCheckpoint.HEADER.size
+    checkpoint.mmap[offset] ^= 0xff
+    assert checkpoint.latest()['/media/hdd/a.mkv'][2] == 10 * 90000
+    checkpoint.close()
+
+
+def test_clear_up_to_sequence(tmp_path):
+    checkpoint = PositionCheckpoint(str(tmp_path / 'positions.checkpoint'))
+    for i in range(4):
+        checkpoint.write('/media/hdd/%d.mkv' % i, i * 90000)
+    checkpoint.clear(2)
+    assert [item[0] for item in checkpoint.read()] == [3, 4]
+    checkpoint.clear()
+    assert checkpoint.read() == []
+    checkpoint.close()
+
+
+def test_reconcile_after_kill(tmp_path):
+    dao = CueSheetDAO(str(tmp_path / 'cuesheet.db'))
+    dao.set_cut_list('/media/hdd/a.mkv', [(60, 0), (100, CUT_TYPE_LAST)])
+    dao.set_cut_list('/media/hdd/b.mkv', [(500, CUT_TYPE_LAST)])
+    # a was saved long before the crash, b after the checkpoint was taken
+    set_last_updated(dao, '/media/hdd/a.mkv', 1)
+    path = str(tmp_path / 'positions.checkpoint')
+    kill_after_checkpoints(path, [
+        ('/media/hdd/a.mkv', 1200 * 90000, 3600 * 90000),
+        ('/media/hdd/b.mkv', 1500 * 90000, None),
+        ('/media/hdd/c.mkv', 42 * 90000, None),
+    ])
+    set_last_updated(dao, '/media/hdd/b.mkv', 2 ** 40)
+    checkpoint = PositionCheckpoint(path)
+    assert dao.reconcile_checkpoints(checkpoint.latest()) == 2
+    checkpoint.close()
+    assert dao.get_cut_list('/media/hdd/a.mkv', by_identity=False) == [(60, 0), (1200, CUT_TYPE_LAST)]
+    assert dao.get_cut_list('/media/hdd/b.mkv', by_identity=False) == [(500, CUT_TYPE_LAST)]
+    assert dao.get_cut_list('/media/hdd/c.mkv', by_identity=False) == [(42, CUT_TYPE_LAST)]
+    assert dao.get_progress(['/media/hdd/a.mkv'])['/media/hdd/a.mkv'] == (1200, 3600)